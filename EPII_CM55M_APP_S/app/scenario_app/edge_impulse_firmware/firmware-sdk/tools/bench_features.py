@@ -0,0 +1,84 @@
+import os
+import time
+import random
+import struct
+import binascii
+import argparse
+import test_inference
+
+# the feature sizes to time: raw audio, 96x96 and 160x160 RGB images
+DEF_SIZES = [16000, 96*96*3, 160*160*3]
+DEF_REPEAT = 5
+
+def legacy_parse(text, image=False):
+    '''Parsing as test_inference.py did it before parse_features().'''
+    if image:
+        return [float(int(num,16)) for num in text.split(',')]
+    return [float(num) for num in text.split(',')]
+
+def legacy_encode(features, out=None):
+    '''base64_encode() before the rewrite, its dumps going to out.'''
+    feature_byte_array = struct.pack('@'+'f'*len(features), *features)
+    res = binascii.b2a_base64(feature_byte_array, newline=False)
+
+    if (out != None):
+        print(len(features), file=out)
+        print(len(features*4), file=out)
+        print(features, file=out)
+        print(str(res)[2:-1], file=out)
+    return str(res)[2:-1]
+
+def make_text(count, image, seed):
+    rng = random.Random(seed)
+    if image:
+        return ','.join('0x{:x}'.format(rng.randrange(0x1000000)) for i in range(count))
+    return ', '.join('{:.4f}'.format(rng.uniform(-20, 20)) for i in range(count))
+
+def best_time(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if (best == None) else min(best, elapsed)
+    return best
+
+def bench(count, image, repeat, seed):
+    text = make_text(count, image, seed)
+    rows = []
+
+    # speedups are against the old parsing without its dumps, so they show
+    # what the buffers gain on top of dropping the prints
+    expected = legacy_encode(legacy_parse(text, image))
+    with open(os.devnull, 'w') as out:
+        rows.append(('old, with dumps', best_time(lambda: legacy_encode(legacy_parse(text, image), out), repeat), True))
+    legacy = best_time(lambda: legacy_encode(legacy_parse(text, image)), repeat)
+    rows.append(('old, no dumps', legacy, True))
+
+    paths = [('array', None)]
+    if (test_inference.np != None):
+        paths.insert(0, ('numpy', test_inference.np))
+    for name, numpy in paths:
+        encode = lambda: test_inference.base64_encode(test_inference.parse_features(text, image, numpy=numpy),
+                                                      log=test_inference.quiet)
+        ok = (encode().decode() == expected)
+        rows.append((name, best_time(encode, repeat), ok))
+
+    kind = 'image' if image else 'raw'
+    for name, elapsed, ok in rows:
+        print("{:6} {:8d} {:20} {:9.2f} ms {:6.1f}x {}".format(
+            kind, count, name, elapsed * 1000, legacy / elapsed, "same output" if ok else "OUTPUT DIFFERS"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time feature parsing and base64 encoding of test_inference.py against the old list path")
+    parser.add_argument("--sizes", default=','.join(str(size) for size in DEF_SIZES), type=str,
+                        help="Comma separated feature counts. Default is " + ','.join(str(size) for size in DEF_SIZES))
+    parser.add_argument("--repeat", default=DEF_REPEAT, type=int,
+                        help="Runs per case, the best one counts. Default is " + str(DEF_REPEAT))
+    parser.add_argument("--seed", default=1, type=int,
+                        help="Random seed of the generated features. Default is 1")
+    args = parser.parse_args()
+
+    for count in [int(size) for size in args.sizes.split(',')]:
+        for image in (False, True):
+            bench(count, image, args.repeat, args.seed)
@@ -2,88 +2,642 @@ import time
 import serial
 import os
 import sys
-import struct
 import binascii
+import argparse
+import glob
+import json
+import csv
+import re
+import itertools
+import threading
+from array import array
 
-def encode_and_send(string, ser):
-    array_to_write = (string.encode())
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# serial record/replay (xmodem_trace.py) lives with the xmodem tools
+XMODEM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', '..', '..', 'xmodem')
+
+DEF_REPLAY_SPEED = 1.0
+
+DEF_RESULTS = 'test_inference_results.jsonl'
+DEF_REPORT = 'test_inference_report.json'
+DEF_PROFILE_CSV = 'test_inference_profile.csv'
+DEF_HANDSHAKE_TIMEOUT = 10
+DEF_SAMPLE_TIMEOUT = 30
+
+# how long to wait for the AT prompt before sending AT again
+HANDSHAKE_RETRY = 0.5
+
+# chunks sent ahead of the device's OK; halved after every failed upload.
+# The firmware polls its UART a byte at a time (uart_read_nonblock), so a
+# larger window is only safe once measured on the board
+DEF_WINDOW = 1
+
+PROMPT = b"> "
+
+TIMING_RE = re.compile(r"Timing: DSP ([\d.]+) ms, inference ([\d.]+) ms, anomaly ([\d.]+) ms")
+BOX_RE = re.compile(r"(.*) \(([-+\d.eE]+)\) \[ x: (\d+), y: (\d+), width: (\d+), height: (\d+) \]")
+
+# predicted label of an object detection run that found nothing
+NO_OBJECT = '(none)'
+
+# per-run times of a profile: host upload, the device's own timing, end to end
+PROFILE_FIELDS = ['upload_ms', 'dsp_ms', 'inference_ms', 'anomaly_ms', 'total_ms']
+PROFILE_PERCENTILES = [50, 90, 99]
+
+def quiet(*args, **kwargs):
+    pass
+
+def encode_and_send(string, ser, log=print):
+    array_to_write = string.encode() if isinstance(string, str) else string
     ser.write(array_to_write)
-    print("Sent: {} Size: {}".format(array_to_write, len(array_to_write)))
+    log("Sent: {} Size: {}".format(array_to_write, len(array_to_write)))
 
-def await_response_exact(response, ser):
-    data_in = b""
-    while data_in != response.encode():
-        data_in = ser.readline()
-        print(data_in)
-        if data_in == b"TIMEOUT\r\n":
-            break
-    return data_in.decode()
+def base64_encode(features, log=print, verbose=False):
+    '''
+    Base64 of the features as float32, straight from their buffer (see
+    parse_features); a plain list is packed first.  Returns bytes.
+    '''
+    if isinstance(features, list):
+        features = array('f', features)
+    res = binascii.b2a_base64(features, newline=False)
+
+    log("{} features, {} bytes, {} base64".format(len(features), len(features)*4, len(res)))
+    if verbose:
+        log(list(features))
+        log(res.decode())
+    return res
 
-def await_response(response, ser):
-    data_in = b""
-    while not response.encode() in data_in:
+def parse_features(text, image=False, numpy=np):
+    '''
+    Comma separated features (hex values for images) to a float32 buffer:
+    a NumPy array with the numpy module (the installed one by default),
+    an array('f') with None.
+    '''
+    if image:
+        values = map(int, text.split(','), itertools.repeat(16))
+        if (numpy != None):
+            return numpy.fromiter(values, dtype=numpy.float32)
+        return array('f', values)
+    if (numpy != None):
+        return numpy.fromstring(text, dtype=numpy.float32, sep=',')
+    return array('f', map(float, text.split(',')))
+
+def load_features(path):
+    with open(path,'r') as f:
+        return parse_features(f.read().strip(), image=('image' in os.path.basename(path)))
+
+def send_uart(data, raw_data_len, ser, sim_timeout=False, window=DEF_WINDOW, timeout=DEF_SAMPLE_TIMEOUT):
+    '''
+    Run one sample: wait for the AT prompt, upload it and print the device
+    output, then close ser.  Returns the run_sample result.
+    '''
+    if (not handshake(ser)):
+        result = {'features': raw_data_len, 'status': 'no response'}
+    else:
+        # sim_timeout holds every chunk back past the device's 100 ms timeout
+        result = run_sample(data, raw_data_len, ser, timeout=timeout, window=window, delay=0.1 if sim_timeout else 0)
+    if ('upload_s' in result):
+        print("Uploaded {} bytes in {:.3f}s, {:.1f} kB/s, window {}".format(
+            len(data), result['upload_s'], result['upload_rate'] / 1000, result['window']))
+
+    if (result['status'] != 'ok'):
+        print("Inference {}. Terminating...".format(result['status']))
+    ser.close()
+    return result
+
+def handshake(ser, timeout=DEF_HANDSHAKE_TIMEOUT, log=print):
+    '''
+    Send AT until the AT prompt comes back, instead of sleeping a fixed time
+    for the board to boot.  Returns False if it never does.
+    '''
+    deadline = time.time() + timeout
+    ser.reset_input_buffer()
+    while time.time() < deadline:
+        encode_and_send("AT\r", ser, log)
+        data_in = b""
+        retry = time.time() + HANDSHAKE_RETRY
+        while time.time() < retry:
+            data_in += ser.read_until(PROMPT)
+            if data_in.endswith(PROMPT):
+                log(data_in)
+                return True
+    return False
+
+def read_output(ser, deadline, log=print):
+    '''Device lines up to END OUTPUT, or None if the deadline passes first.'''
+    lines = []
+    while time.time() < deadline:
         data_in = ser.readline()
-        print(data_in)
-        if data_in == b"TIMEOUT\r\n":
+        if not data_in:
+            continue
+        log(data_in)
+        line = data_in.decode(errors='replace').strip()
+        if line == "END OUTPUT":
+            return lines
+        if line:
+            lines.append(line)
+    return None
+
+def upload_chunks(data, chunk_size, raw_data_len, ser, window, deadline, log=print, delay=0):
+    '''
+    Send data (a multiple of chunk_size) keeping up to window chunks ahead
+    of the device's "OK <floats>" answers, which a reader thread collects
+    while the next chunks go out.  Returns 'ok', 'timeout' (the device gave
+    up waiting for data), 'out of sync' (an OK that does not match the
+    chunks sent, i.e. bytes were lost) or 'no response'.
+    '''
+    chunks = len(data) // chunk_size
+    floats_per_chunk = chunk_size // 4 * 3 // 4
+    cond = threading.Condition()
+    state = {'acked': 0, 'status': None}
+
+    def finish(status):
+        if (state['status'] == None):
+            state['status'] = status
+        cond.notify_all()
+
+    def reader():
+        while True:
+            with cond:
+                if (state['status'] != None):
+                    return
+            data_in = ser.readline()
+            if not data_in:
+                if time.time() >= deadline:
+                    with cond:
+                        finish('no response')
+                continue
+            log(data_in)
+            line = data_in.decode(errors='replace').split()
+            with cond:
+                if (line == ["TIMEOUT"]):
+                    finish('timeout')
+                elif (len(line) == 2) and (line[0] == "OK"):
+                    if (line[1] != str(min(raw_data_len, (state['acked'] + 1) * floats_per_chunk))):
+                        finish('out of sync')
+                        continue
+                    state['acked'] += 1
+                    if (state['acked'] == chunks):
+                        finish('ok')
+                    cond.notify_all()
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    sent = 0
+    while True:
+        with cond:
+            while (state['status'] == None) and ((sent == chunks) or (sent - state['acked'] >= window)):
+                if time.time() >= deadline:
+                    finish('no response')
+                    break
+                cond.wait(deadline - time.time())
+            if (state['status'] != None):
+                break
+        encode_and_send(data[sent * chunk_size:(sent + 1) * chunk_size], ser, log)
+        sent += 1
+        if delay:
+            time.sleep(delay)
+    thread.join()
+    return state['status']
+
+def parse_output(lines):
+    '''
+    Structured results from the device output of one run: the timing line,
+    the class scores ("Predictions:") or bounding boxes ("Object detection
+    bounding boxes:") and the anomaly score if there is one.  'predicted'
+    is the best scoring class, or the label of the best box.
+    '''
+    parsed = {}
+    section = None
+    for line in lines:
+        match = TIMING_RE.match(line)
+        box = BOX_RE.match(line)
+        if match:
+            parsed['timing'] = dict(zip(('dsp_ms', 'inference_ms', 'anomaly_ms'), map(float, match.groups())))
+        elif (line == "Predictions:"):
+            section = parsed['predictions'] = {}
+        elif (line == "Object detection bounding boxes:"):
+            section = parsed['boxes'] = []
+        elif line.startswith("Anomaly prediction:"):
+            parsed['anomaly'] = float(line.split(':')[1])
+        elif isinstance(section, list) and box:
+            label, score, x, y, width, height = box.groups()
+            section.append({'label': label, 'score': float(score),
+                            'x': int(x), 'y': int(y), 'width': int(width), 'height': int(height)})
+        elif isinstance(section, dict) and re.match(r".+: [-+\d.eE]+$", line):
+            label, value = line.rsplit(':', 1)
+            section[label] = float(value)
+        else:
+            section = None
+
+    if parsed.get('predictions'):
+        parsed['predicted'] = max(parsed['predictions'], key=parsed['predictions'].get)
+    elif ('boxes' in parsed):
+        parsed['predicted'] = max(parsed['boxes'], key=lambda box: box['score'])['label'] if parsed['boxes'] else NO_OBJECT
+    return parsed
+
+def run_sample(data, raw_data_len, ser, timeout=DEF_SAMPLE_TIMEOUT, log=print, window=DEF_WINDOW, delay=0):
+    '''
+    One AT+RUNIMPULSESTATIC run on an open session whose AT prompt was
+    already seen.  Returns a result dict; the prompt after END OUTPUT is
+    consumed so the next sample can start right away.  If the device loses
+    part of a windowed upload the run is repeated with half the window;
+    result['window'] is the one that worked.
+    '''
+    start = time.time()
+    deadline = start + timeout
+    result = {'features': raw_data_len, 'status': 'ok', 'window': window, 'retries': 0}
+
+    while True:
+        encode_and_send("AT+RUNIMPULSESTATIC=n,{}\r".format(raw_data_len), ser, log)
+        response = b""
+        while (b"OK CHUNK=" not in response) and (b"ERR" not in response):
+            if time.time() >= deadline:
+                result['status'] = 'no response'
+                return result
+            response = ser.readline()
+            log(response)
+        if b"ERR" in response:
+            result['status'] = 'error'
+            result['output'] = [response.decode(errors='replace').strip()]
+            ser.read_until(PROMPT)
+            return result
+
+        chunk_size = int(''.join(filter(str.isdigit, response.decode(errors='replace'))))
+        result['chunk_size'] = chunk_size
+
+        padded = data
+        data_modulo = len(data) % chunk_size
+        if data_modulo:
+            padded = data + b"="*(chunk_size-data_modulo)
+
+        upload_start = time.time()
+        status = upload_chunks(padded, chunk_size, raw_data_len, ser, window, deadline, log, delay)
+        if (status == 'no response'):
+            result['status'] = status
+            return result
+        result['upload_s'] = time.time() - upload_start
+        result['upload_rate'] = len(padded) / result['upload_s']
+
+        lines = read_output(ser, deadline, log)
+        if (lines == None):
+            result['status'] = 'no response'
+            return result
+        if (status == 'ok') or (window == 1):
             break
-    return data_in.decode()
 
-def base64_encode(features):
-    feature_byte_array = struct.pack('@'+'f'*len(features), *features)
-    res = binascii.b2a_base64(feature_byte_array, newline=False)
+        # Chunks still in flight reach the AT command line once the device
+        # gave up: the handshake flushes them out before the next try.
+        log("Upload {} with window {}, retrying with {}".format(status, window, window // 2))
+        ser.read_until(PROMPT)
+        if (not handshake(ser, log=log)):
+            result['status'] = 'no response'
+            return result
+        window = window // 2
+        result['window'] = window
+        result['retries'] += 1
 
-    print(len(features))
-    print(len(features*4))
-    print(features)
-    print(str(res)[2:-1])
-    return str(res)[2:-1]
+    if (status != 'ok'):
+        result['status'] = status
+    result['output'] = lines
+    result.update(parse_output(lines))
+    for line in lines:
+        if line.startswith("RESULT "):
+            result['result'] = int(line.split()[1])
+    if (result['status'] == 'ok') and (result.get('result', 0) != 0):
+        result['status'] = 'error'
 
-def send_uart(data, raw_data_len, ser, sim_timeout=False):
+    ser.read_until(PROMPT)
+    result['total_s'] = time.time() - start
+    return result
 
-    data_sent = 0
+def list_samples(spec):
+    '''
+    Samples named by spec as (path, label) pairs: every .txt file under a
+    directory, the files matching a glob pattern, or the lines of a .csv
+    manifest ("path[,label]", paths relative to the manifest, # comments).
+    '''
+    if os.path.isdir(spec):
+        return [(path, None) for path in sorted(glob.glob(os.path.join(spec, '**', '*.txt'), recursive=True))]
+    if glob.has_magic(spec):
+        return [(path, None) for path in sorted(glob.glob(spec, recursive=True))]
+    if spec.endswith('.csv'):
+        samples = []
+        base = os.path.dirname(spec)
+        with open(spec, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if (not line) or line.startswith('#'):
+                    continue
+                fields = [field.strip() for field in line.split(',')]
+                if (fields[0] == 'file'):
+                    continue
+                label = fields[1] if (len(fields) > 1 and fields[1]) else None
+                samples.append((os.path.join(base, fields[0]), label))
+        return samples
+    return None
 
-    time.sleep(2)
+def run_batch(samples, ser, results_path, timeout=DEF_SAMPLE_TIMEOUT, log=quiet, verbose=False, window=DEF_WINDOW):
+    '''
+    Run all samples back to back on one open session with one handshake,
+    writing a JSON line per sample to results_path.  A window the device
+    could not keep up with stays reduced for the following samples.
+    Returns the results and the time they took.
+    '''
+    if (not handshake(ser, log=log)):
+        print("No AT prompt from the device")
+        return [], 0.0
 
-    encode_and_send("AT\r", ser)
-    response = await_response_exact("> ", ser)
+    passed = 0
+    results = []
+    start = time.time()
+    with open(results_path, 'w') as out:
+        for index, (path, label) in enumerate(samples):
+            try:
+                data = load_features(path)
+            except (OSError, ValueError) as e:
+                result = {'status': 'error', 'error': str(e)}
+            else:
+                result = run_sample(base64_encode(data, log, verbose), len(data), ser, timeout, log, window)
+                window = result['window']
+            result = dict({'index': index, 'sample': path, 'label': label}, **result)
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            results.append(result)
 
-    encode_and_send("AT+RUNIMPULSESTATIC=n,{}\r".format(raw_data_len), ser)
-    response = await_response("OK", ser)
+            if (result['status'] == 'ok'):
+                passed += 1
+            upload = ""
+            if ('upload_rate' in result):
+                upload = ", upload {:.1f} kB/s (window {})".format(result['upload_rate'] / 1000, result['window'])
+            print("[{}/{}] {} {} {:.3f}s{}".format(index + 1, len(samples), path, result['status'], result.get('total_s', 0.0), upload))
 
-    chunk_size = int(''.join(filter(str.isdigit, response)))
-    print("Chunk size is {}".format(chunk_size))
+            if (result['status'] == 'no response') and (not handshake(ser, log=log)):
+                print("Device stopped answering, giving up")
+                break
 
-    data_modulo = len(data) % chunk_size
-    if data_modulo:
-        # pad data to be multiple of chunk size with '='
-        print("Data size before padding {}".format(len(data)) )
-        data = data + "="*(chunk_size-data_modulo)
-        print("Data size after padding {}".format(len(data)))
+    elapsed = time.time() - start
+    print("{}/{} samples ok in {:.3f}s, {:.2f} samples/s, results in {}".format(
+        passed, len(samples), elapsed, len(samples) / elapsed if elapsed > 0 else 0.0, results_path))
+    return results, elapsed
 
-    while data_sent < len(data):
-        encode_and_send("{}".format(data[data_sent:data_sent + chunk_size]), ser)
-        time.sleep(0.01)
-        data_sent += chunk_size
-        print("Total sent: {}".format(data_sent))
-        response = await_response("OK", ser)
+def evaluate(results, elapsed):
+    '''
+    Report of a batch run against the labels of its manifest: accuracy
+    (samples that failed count as wrong), a confusion matrix with a row per
+    expected and a column per predicted label, and samples/s.
+    '''
+    labelled = [result for result in results if (result['label'] != None)]
+    scored = [result for result in labelled if (result['status'] == 'ok') and ('predicted' in result)]
+    labels = sorted(set(result['label'] for result in labelled) | set(result['predicted'] for result in scored))
+    index = dict((label, i) for i, label in enumerate(labels))
 
-        if sim_timeout:
-            time.sleep(0.1)
-        if response == "TIMEOUT\r\n":
-            print("Data send time out. Terminating...")
-            ser.close()
-            sys.exit(1)
+    confusion = [[0] * len(labels) for label in labels]
+    for result in scored:
+        confusion[index[result['label']]][index[result['predicted']]] += 1
+    correct = sum(result['label'] == result['predicted'] for result in scored)
 
-    response = await_response_exact("END OUTPUT\r\n", ser)
-    ser.close()
+    return {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'samples': len(results),
+        'labelled': len(labelled),
+        'failed': len(labelled) - len(scored),
+        'correct': correct,
+        'accuracy': correct / len(labelled) if labelled else None,
+        'samples_per_s': len(results) / elapsed if elapsed > 0 else 0.0,
+        'labels': labels,
+        'confusion': confusion,
+        'results': [{'sample': result['sample'], 'label': result['label'], 'status': result['status'],
+                     'predicted': result.get('predicted')} for result in labelled],
+    }
 
-if __name__ == "__main__":
-    ser = serial.Serial(sys.argv[2], 115200, timeout=0.050)
-    with open(sys.argv[1],'r') as f:
-        data = f.read()
-        if 'image' in sys.argv[1]:
-            data = [float(int(num,16)) for num in data.split(',')]
+def print_report(report, log=print):
+    if (report['accuracy'] == None):
+        log("No labelled samples to evaluate, a .csv manifest gives the labels")
+        return
+    log("Accuracy {}/{} = {:.2%}, {} failed, {:.2f} samples/s".format(
+        report['correct'], report['labelled'], report['accuracy'], report['failed'], report['samples_per_s']))
+
+    # expected label per row, predicted label per column
+    width = max(len(label) for label in report['labels'] + ['expected'])
+    log("{:<{}}  {}".format('expected', width, '  '.join(label.rjust(len(label)) for label in report['labels'])))
+    for label, row in zip(report['labels'], report['confusion']):
+        log("{:<{}}  {}".format(label, width, '  '.join(str(count).rjust(len(column)) for count, column in zip(row, report['labels']))))
+
+def diff_reports(old, new, log=print):
+    '''
+    Print what changed since the old report: accuracy, speed and every
+    sample whose prediction moved.  Returns True if accuracy went down.
+    '''
+    if (old.get('accuracy') == None) or (new['accuracy'] == None):
+        log("Nothing to compare with the previous report")
+        return False
+    log("Since {}: accuracy {:.2%} -> {:.2%} ({:+.2%}), {:.2f} -> {:.2f} samples/s".format(
+        old['created'], old['accuracy'], new['accuracy'], new['accuracy'] - old['accuracy'],
+        old['samples_per_s'], new['samples_per_s']))
+
+    before = dict((result['sample'], result) for result in old['results'])
+    for result in new['results']:
+        previous = before.get(result['sample'])
+        if (previous == None) or (previous['predicted'] == result['predicted']):
+            continue
+        if (result['predicted'] == result['label']):
+            change = 'fixed'
+        elif (previous['predicted'] == previous['label']):
+            change = 'broken'
         else:
-            data = [float(num) for num in data.split(',')]
-    encoded_data = base64_encode(data)
-    send_uart(encoded_data, len(data), ser, sim_timeout=False)
\ No newline at end of file
+            change = 'changed'
+        log("  {} {}: {} -> {} (expected {})".format(change, result['sample'], previous['predicted'], result['predicted'], result['label']))
+    return new['accuracy'] < old['accuracy']
+
+def percentile(values, p):
+    '''p-th percentile of sorted values, interpolating between neighbours.'''
+    position = (len(values) - 1) * p / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def run_profile(samples, ser, runs, csv_path, timeout=DEF_SAMPLE_TIMEOUT, log=quiet, verbose=False, window=DEF_WINDOW):
+    '''
+    Run every sample runs times on one session, writing a CSV row per run
+    with the host upload time, the DSP/inference/anomaly times the device
+    reports and the end to end time.  Returns the rows of the runs that
+    worked, as dicts of PROFILE_FIELDS.
+    '''
+    if (not handshake(ser, log=log)):
+        print("No AT prompt from the device")
+        return []
+
+    rows = []
+    with open(csv_path, 'w', newline='') as f:
+        out = csv.writer(f)
+        out.writerow(['sample', 'run', 'status'] + PROFILE_FIELDS)
+        for index, (path, label) in enumerate(samples):
+            try:
+                data = load_features(path)
+            except (OSError, ValueError) as e:
+                print("[{}/{}] {} error {}".format(index + 1, len(samples), path, e))
+                out.writerow([path, '', 'error'])
+                continue
+
+            encoded = base64_encode(data, log, verbose)
+            passed = []
+            for run in range(runs):
+                result = run_sample(encoded, len(data), ser, timeout, log, window)
+                window = result.get('window', window)
+                status = result['status']
+                if (status == 'ok') and ('timing' not in result):
+                    status = 'no timing'
+
+                row = dict(result.get('timing', {}))
+                if ('upload_s' in result):
+                    row['upload_ms'] = result['upload_s'] * 1000
+                if ('total_s' in result):
+                    row['total_ms'] = result['total_s'] * 1000
+                out.writerow([path, run + 1, status] + ['{:.3f}'.format(row[field]) if (field in row) else '' for field in PROFILE_FIELDS])
+                if (status == 'ok'):
+                    passed.append(row)
+                elif (status == 'no response') and (not handshake(ser, log=log)):
+                    print("Device stopped answering, giving up")
+                    return rows + passed
+
+            rows += passed
+            inference = sorted(row['inference_ms'] for row in passed)
+            print("[{}/{}] {} {}/{} runs ok{}".format(index + 1, len(samples), path, len(passed), runs,
+                  ", inference p50 {:.3f} ms".format(percentile(inference, 50)) if inference else ""))
+    return rows
+
+def print_profile(rows, log=print):
+    if (not rows):
+        log("No run finished")
+        return
+    log("{} runs, times in ms".format(len(rows)))
+    log("{:<12}{:>10}{:>10}".format('', 'min', 'mean') + ''.join("{:>10}".format('p' + str(p)) for p in PROFILE_PERCENTILES) + "{:>10}".format('max'))
+    for field in PROFILE_FIELDS:
+        values = sorted(row[field] for row in rows)
+        stats = [values[0], sum(values) / len(values)] + [percentile(values, p) for p in PROFILE_PERCENTILES] + [values[-1]]
+        log("{:<12}".format(field[:-3]) + ''.join("{:>10.3f}".format(value) for value in stats))
+
+def load_trace():
+    if XMODEM_DIR not in sys.path:
+        sys.path.append(XMODEM_DIR)
+    import xmodem_trace
+    return xmodem_trace
+
+def open_serial(args):
+    if (args.record == None) and (args.replay == None):
+        return serial.Serial(args.port, 115200, timeout=0.050)
+
+    trace = load_trace()
+    if (args.replay != None):
+        ser = trace.ReplaySerial(args.replay, port=args.port or args.replay, baudrate=115200,
+                                 timeout=0.050, speed=args.replay_speed)
+    else:
+        ser = serial.Serial(args.port, 115200, timeout=0.050)
+    if (args.record != None):
+        ser = trace.RecordingSerial(ser, args.record)
+    return ser
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", type=str,
+                        help="Features file; image features (hex values) need 'image' in the file name. "
+                             "A directory, glob pattern or .csv manifest runs all its samples in one session")
+    parser.add_argument("port", type=str, nargs='?',
+                        help="Serial device port, not needed with --replay")
+    parser.add_argument("--record", type=str,
+                        help="Log every byte read and written with timestamps to this trace file (gzip compressed for a .gz name)")
+    parser.add_argument("--replay", type=str,
+                        help="Run against a trace written by --record instead of the serial port")
+    parser.add_argument("--replay-speed", default=DEF_REPLAY_SPEED, type=float,
+                        help="Replay timing: 1 as recorded, 2 twice as fast, 0 as fast as possible. Default is " + str(DEF_REPLAY_SPEED))
+    parser.add_argument("--results", default=DEF_RESULTS, type=str,
+                        help="Per-sample results (JSON lines) of a batch run. Default is " + DEF_RESULTS)
+    parser.add_argument("--sample-timeout", default=DEF_SAMPLE_TIMEOUT, type=float,
+                        help="Give up on a sample after this many seconds. Default is " + str(DEF_SAMPLE_TIMEOUT))
+    parser.add_argument("--verbose", action='store_true',
+                        help="Print the features and their base64 encoding, and in a batch run all device traffic")
+    parser.add_argument("--evaluate", action='store_true',
+                        help="Compare the predictions of a batch run with the labels of its .csv manifest: print accuracy, "
+                             "a confusion matrix and the changes since the previous report, and fail if accuracy dropped")
+    parser.add_argument("--report", default=DEF_REPORT, type=str,
+                        help="Evaluation report (JSON) to write; an existing one is the previous run to compare with. Default is " + DEF_REPORT)
+    parser.add_argument("--baseline", type=str,
+                        help="Report to compare the evaluation with instead of the previous --report")
+    parser.add_argument("--accept", action='store_true',
+                        help="Write --report even if accuracy dropped; otherwise such a report goes next to it as <report>.new.json")
+    parser.add_argument("--profile", type=int, metavar='RUNS',
+                        help="Run every sample this many times and print percentiles of the upload, DSP, inference, "
+                             "anomaly and end to end times")
+    parser.add_argument("--profile-csv", default=DEF_PROFILE_CSV, type=str,
+                        help="Per-run times of --profile. Default is " + DEF_PROFILE_CSV)
+    parser.add_argument("--window", default=DEF_WINDOW, type=int,
+                        help="Chunks to send ahead of the device's OK, halved whenever the device loses data; "
+                             "1 waits for every OK. Default is " + str(DEF_WINDOW))
+    args = parser.parse_args()
+
+    if (args.port == None) and (args.replay == None):
+        parser.error("the port argument is required without --replay")
+    if (args.window < 1):
+        parser.error("--window must be at least 1")
+
+    samples = list_samples(args.file)
+    if (samples != None) and (len(samples) == 0):
+        print("No samples in {}".format(args.file))
+        sys.exit(1)
+    if args.evaluate and (samples == None):
+        parser.error("--evaluate needs a directory, glob pattern or .csv manifest")
+    if (args.profile != None) and ((args.profile < 1) or args.evaluate):
+        parser.error("--profile needs at least 1 run and does not go with --evaluate")
+
+    start = time.time()
+    regressed = False
+    failed = False
+    ser = open_serial(args)
+    if (args.profile != None):
+        if (samples == None):
+            samples = [(args.file, None)]
+        rows = run_profile(samples, ser, args.profile, args.profile_csv, args.sample_timeout,
+                           log=print if args.verbose else quiet, verbose=args.verbose, window=args.window)
+        passed = len(samples) if (len(rows) == len(samples) * args.profile) else 0
+        ser.close()
+        print_profile(rows)
+        print("Per-run times in {}".format(args.profile_csv))
+    elif (samples != None):
+        results, elapsed = run_batch(samples, ser, args.results, args.sample_timeout,
+                                     log=print if args.verbose else quiet, verbose=args.verbose, window=args.window)
+        passed = sum(result['status'] == 'ok' for result in results)
+        ser.close()
+
+        if args.evaluate:
+            report = evaluate(results, elapsed)
+            print_report(report)
+            baseline = args.baseline or args.report
+            if os.path.exists(baseline):
+                with open(baseline, 'r') as f:
+                    regressed = diff_reports(json.load(f), report)
+            report_path = args.report
+            if regressed and (not args.accept):
+                # keep the baseline, or rerunning a failed gate would pass
+                report_path = os.path.splitext(args.report)[0] + '.new.json'
+                print("Accuracy dropped, {} is left as it is (--accept replaces it)".format(args.report))
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=1)
+            print("Report in {}".format(report_path))
+    else:
+        data = load_features(args.file)
+        encoded_data = base64_encode(data, verbose=args.verbose)
+        result = send_uart(encoded_data, len(data), ser, sim_timeout=False, window=args.window, timeout=args.sample_timeout)
+        failed = (result['status'] != 'ok')
+
+    if (args.record != None) or (args.replay != None):
+        print(ser.report())
+        print("Total time: {:.3f}s".format(time.time() - start))
+
+    if ((samples != None) and (passed < len(samples))) or regressed or failed:
+        sys.exit(1)
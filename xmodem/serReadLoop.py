@@ -28,6 +28,10 @@ import sys
 import logging
 import argparse
 import threading
+from xmodem_capture import SerialCapture, DEF_RING_SIZE, DEF_MAX_BYTES
+from xmodem_fleet import is_fleet
+from xmodem_multiport import MultiPortLogger, DEF_RESCAN
+from xmodem_metrics import LineMetrics, MetricsReporter, builtin_rules, load_rules, parse_rule_arg, DEF_WINDOW, DEF_INTERVAL, DEF_CPU_MHZ
 
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -62,19 +66,97 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--port",
                         required=True, type=str,
-                        help="Serial device port: COMn for windows; /dev/ttyUSBn,/dev/ttySn for unix; /dev/tty.usbserial-abcde for MacOS")
+                        help="Serial device port: COMn for windows; /dev/ttyUSBn,/dev/ttySn for unix; /dev/tty.usbserial-abcde for MacOS. A comma separated list or glob (/dev/ttyACM*) logs all matching ports")
     parser.add_argument("--baudrate",
                         default=DEF_BAUDRATE, type=lambda x: int(x,0),
                         help="Serial device baudrate. Default is " + str(DEF_BAUDRATE))
     parser.add_argument("--timeout",
                         default=DEF_TIMEOUT, type=lambda x: int(x,0),
                         help="Serial device timeout. Default is " + str(DEF_TIMEOUT))
+    parser.add_argument("--capture", type=str,
+                        help="Binary-safe capture: write the raw bytes to rotating <CAPTURE>.<n>.bin files with a timestamp index")
+    parser.add_argument("--max-bytes",
+                        default=DEF_MAX_BYTES, type=lambda x: int(x,0),
+                        help="Capture segment size in bytes. Default is " + str(DEF_MAX_BYTES))
+    parser.add_argument("--max-files",
+                        default=0, type=int,
+                        help="Keep only the newest N capture segments, 0 keeps all. Default is 0")
+    parser.add_argument("--compress", action='store_true',
+                        help="gzip the capture segments")
+    parser.add_argument("--ring-size",
+                        default=DEF_RING_SIZE, type=lambda x: int(x,0),
+                        help="Capture ring buffer size in bytes. Default is " + str(DEF_RING_SIZE))
+    parser.add_argument("--log-dir", type=str,
+                        help="Multi-port: also write one <port>.log per port into this directory")
+    parser.add_argument("--merged", type=str,
+                        help="Multi-port: write the merged log to this file instead of stdout")
+    parser.add_argument("--rescan",
+                        default=DEF_RESCAN, type=float,
+                        help="Multi-port: look for new ports every N seconds. Default is " + str(DEF_RESCAN))
+    parser.add_argument("--metrics-json", type=str,
+                        help="Append rolling metrics parsed from the device log (FPS, timings, detections) as JSON lines to this file, '-' for stdout")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve the rolling metrics in Prometheus text format on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-interval",
+                        default=DEF_INTERVAL, type=float,
+                        help="Seconds between --metrics-json lines. Default is " + str(DEF_INTERVAL))
+    parser.add_argument("--metrics-window",
+                        default=DEF_WINDOW, type=float,
+                        help="Rolling metrics window in seconds. Default is " + str(DEF_WINDOW))
+    parser.add_argument("--rule", action='append',
+                        help="Extra metrics rule NAME=REGEX, numeric named groups become metrics. Can be given several times")
+    parser.add_argument("--rules", type=str,
+                        help="JSON file with extra metrics rules: [{\"name\", \"pattern\", \"frame\", \"scale\"}]")
+    parser.add_argument("--cpu-mhz",
+                        default=DEF_CPU_MHZ, type=float,
+                        help="CPU clock converting 'Tick for ...' counters to ms. Default is " + str(DEF_CPU_MHZ))
     args = parser.parse_args()
 
+    metrics = None
+    reporter = None
+    if (args.metrics_json != None) or (args.metrics_port != None):
+        rules = builtin_rules(args.cpu_mhz)
+        if (args.rules != None):
+            rules += load_rules(args.rules)
+        for rule in (args.rule or []):
+            rules.append(parse_rule_arg(rule))
+        metrics = LineMetrics(rules, window=args.metrics_window)
+        reporter = MetricsReporter(metrics, json_path=args.metrics_json, interval=args.metrics_interval, port=args.metrics_port)
+
+    if is_fleet(args.port):
+        merged = sys.stdout if (args.merged == None) else open(args.merged, 'a')
+        MultiPortLogger(args.port, args.baudrate, merged=merged, log_dir=args.log_dir, rescan=args.rescan,
+                        on_line=metrics.feed if (metrics != None) else None).run()
+        if (reporter != None):
+            reporter.close()
+        sys.exit(0)
+
     dev_init()
     print('Device init successfully')
 
-    while(True):
-        response = ser.readline().strip()
-        print(str(response))
+    if (args.capture != None):
+        capture = SerialCapture(ser, args.capture, ring_size=args.ring_size, max_bytes=args.max_bytes,
+                                max_files=args.max_files, compress=args.compress,
+                                on_line=metrics.feed if (metrics != None) else None)
+        capture.start()
+        try:
+            while capture.alive():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        capture.stop()
+        print(capture.report())
+        if (reporter != None):
+            reporter.close()
+        sys.exit(0)
+
+    try:
+        while(True):
+            response = ser.readline().strip()
+            print(str(response))
+            if (metrics != None):
+                metrics.feed(response.decode(errors='replace'))
+    except KeyboardInterrupt:
+        if (reporter != None):
+            reporter.close()
 
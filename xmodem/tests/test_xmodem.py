@@ -0,0 +1,162 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+End-to-end tests of xmodem_send.py and xmodem_recv.py against the
+simulated devices of xmodem_bench.py (Linux pty pairs).
+'''
+
+import os
+import sys
+import json
+import threading
+import subprocess
+from xmodem_fleet import port_file_name
+from xmodem_bench import EmulatedLink, SimBootloader, SimSender, bench_send, bench_async, TOOL_DIR
+
+RUN_TIMEOUT = 60
+
+def run_tool(name, *argv):
+    '''Run a tool to completion; returns (returncode, stdout).'''
+    proc = subprocess.run([sys.executable, os.path.join(TOOL_DIR, name)] + [str(arg) for arg in argv],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=RUN_TIMEOUT)
+    return proc.returncode, proc.stdout
+
+def start_bootloader(**link_args):
+    link = EmulatedLink(**link_args)
+    device = SimBootloader(link)
+    threading.Thread(target=device.run, daemon=True).start()
+    return link, device
+
+def write_image(path, size):
+    data = os.urandom(size)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+def test_stream_send_with_bit_errors(tmp_path):
+    row = bench_send('xmodem1k', 65536, {'ber': 2e-5, 'seed': 1}, str(tmp_path), window=16, stream=True, timeout=RUN_TIMEOUT)
+    assert row['ok']
+    assert row['retransmits'] > 0
+
+def test_incremental_skips_unchanged_images(tmp_path):
+    firmware = tmp_path / 'fw.bin'
+    model = tmp_path / 'model.bin'
+    write_image(firmware, 20000)
+    write_image(model, 10000)
+    # every run gets a new pty, the ledger has to know the board by name
+    argv = ['--file', firmware, '--model', '{0} 200000 0'.format(model), '--protocol', 'xmodem1k',
+            '--ledger', tmp_path / 'ledger.json', '--board-id', 'board0', '--incremental', '--exit']
+
+    link, device = start_bootloader()
+    returncode, output = run_tool('xmodem_send.py', '--port', link.port, *argv)
+    link.close()
+    assert returncode == 0, output
+    # firmware, model preamble and model
+    assert len(device.files) == 3
+
+    new_model = write_image(model, 12000)
+    link, device = start_bootloader()
+    returncode, output = run_tool('xmodem_send.py', '--port', link.port, *argv)
+    link.close()
+    assert returncode == 0, output
+    assert "unchanged, skip >> {0}".format(firmware) in output
+    assert len(device.files) == 2
+    assert device.files[1][:len(new_model)] == new_model
+
+    # nothing changed: the port is not even read
+    link = EmulatedLink()
+    for option in ('--incremental', '--resume'):
+        returncode, output = run_tool('xmodem_send.py', '--port', link.port,
+                                      *[option if (arg == '--incremental') else arg for arg in argv])
+        assert returncode == 0, output
+        assert "all images unchanged, nothing to send" in output
+    link.close()
+
+def test_replay_matches_recording(tmp_path):
+    image = tmp_path / 'image.bin'
+    write_image(image, 30000)
+    trace = tmp_path / 'send.trace.gz'
+    argv = ['--file', image, '--protocol', 'xmodem1k', '--ledger', tmp_path / 'ledger.json', '--exit']
+
+    link, device = start_bootloader(latency=0.001)
+    returncode, recorded = run_tool('xmodem_send.py', '--port', link.port, '--record', trace, *argv)
+    link.close()
+    assert returncode == 0, recorded
+
+    for speed in ('1', '0'):
+        returncode, replayed = run_tool('xmodem_send.py', '--port', 'replay', '--replay', trace, '--replay-speed', speed, *argv)
+        assert returncode == 0, replayed
+        assert "host output matches the recording" in replayed
+        assert "xmodem_send bytes =  30000" in replayed
+
+def test_recv_replay_writes_same_file(tmp_path):
+    data = os.urandom(20000)
+    trace = tmp_path / 'recv.trace'
+    link = EmulatedLink()
+    device = SimSender(link, data, 'xmodem1k')
+    threading.Thread(target=device.run, daemon=True).start()
+    returncode, output = run_tool('xmodem_recv.py', '--port', link.port, '--file', tmp_path / 'recorded.bin',
+                                  '--size', len(data), '--record', trace, '--exit')
+    link.close()
+    assert returncode == 0, output
+
+    returncode, output = run_tool('xmodem_recv.py', '--port', 'replay', '--file', tmp_path / 'replayed.bin',
+                                  '--size', len(data), '--replay', trace, '--replay-speed', '0', '--exit')
+    assert returncode == 0, output
+    assert (tmp_path / 'recorded.bin').read_bytes() == data
+    assert (tmp_path / 'replayed.bin').read_bytes() == data
+
+def test_async_driver_on_one_loop():
+    for direction in ('send', 'recv'):
+        row = bench_async(direction, 'xmodem1k', 20000, {}, ports=3, window=16, stream=True, timeout=RUN_TIMEOUT)
+        assert row['ok'], direction
+
+def test_fleet_writes_report_and_trace_per_port(tmp_path):
+    image = tmp_path / 'image.bin'
+    data = write_image(image, 30000)
+    boards = [start_bootloader() for _ in range(3)]
+    ports = ','.join(link.port for link, device in boards)
+    argv = ['--file', image, '--protocol', 'xmodem1k', '--ledger', tmp_path / 'ledger.json', '--fleet-timeout', 30]
+
+    returncode, output = run_tool('xmodem_send.py', '--port', ports, '--report', tmp_path / 'report.json',
+                                  '--record', tmp_path / 'trace.gz', *argv)
+    for link, device in boards:
+        link.close()
+    assert returncode == 0, output
+    assert "fleet: 3/3 ok" in output
+
+    for link, device in boards:
+        assert device.files[0][:len(data)] == data
+        with open(port_file_name(str(tmp_path / 'report.json'), link.port)) as f:
+            sessions = json.load(f)['sessions']
+        assert len(sessions) == 1
+        assert sessions[0]['ok']
+        assert os.path.exists(port_file_name(str(tmp_path / 'trace.gz'), link.port))
+    assert not (tmp_path / 'report.json').exists()
+
+    # every board plays back its own trace
+    returncode, output = run_tool('xmodem_send.py', '--port', ports, '--replay', tmp_path / 'trace.gz',
+                                  '--replay-speed', '0', *argv)
+    assert returncode == 0, output
+    assert "fleet: 3/3 ok" in output
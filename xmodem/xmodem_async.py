@@ -0,0 +1,396 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import asyncio
+import logging
+import collections
+import serial
+from xmodem import SOH, STX, EOT, ACK, NAK, CAN, CRC
+from xmodem_ext import XMODEMExt, GMODE, DEF_WINDOW
+
+DEF_TIMEOUT = 60
+DEF_BAUDRATE = 115200
+# Poll period of the fallback reader on platforms without add_reader
+DEF_POLL = 0.01
+
+PACKET_SIZE = {'xmodem': 128, 'xmodem1k': 1024}
+
+log = logging.getLogger('xmodem.async')
+
+class AsyncSerial(object):
+    '''
+    asyncio transport over a pyserial port.
+
+    On POSIX the port's file descriptor is watched by the event loop
+    (``add_reader``/``add_writer``), so an idle port costs nothing and
+    hundreds of ports can share one loop.  Elsewhere a reader task polls
+    ``in_waiting``.  Incoming bytes land in a buffer that ``read()`` and
+    ``expect()`` wait on; every wait takes its own timeout.
+    '''
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.loop = asyncio.get_running_loop()
+        self.buf = bytearray()
+        self.changed = asyncio.Event()
+        self.closed = False
+        self.poller = None
+        self.fd = ser.fileno() if (os.name == 'posix') else None
+
+        if (self.fd != None):
+            self.loop.add_reader(self.fd, self._on_readable)
+        else:
+            self.poller = self.loop.create_task(self._poll())
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            # port went away
+            self.loop.remove_reader(self.fd)
+            self.closed = True
+        self.buf += data
+        self.changed.set()
+
+    async def _poll(self):
+        while not self.closed:
+            waiting = self.ser.in_waiting
+            if waiting:
+                self.buf += self.ser.read(waiting)
+                self.changed.set()
+            else:
+                await asyncio.sleep(DEF_POLL)
+
+    async def _wait(self, ready, timeout):
+        '''Wait until ready() or the timeout; returns ready().'''
+        async def wait():
+            while not ready() and not self.closed:
+                self.changed.clear()
+                await self.changed.wait()
+        try:
+            await asyncio.wait_for(wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return ready()
+
+    async def read(self, size, timeout=1):
+        '''
+        Read size bytes.  Returns fewer on timeout, or None if nothing
+        arrived (the convention of the xmodem getc).
+        '''
+        await self._wait(lambda: len(self.buf) >= size, timeout)
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data or None
+
+    async def expect(self, pattern, timeout=None):
+        '''
+        Wait for a precompiled bytes pattern; drops the input up to the end
+        of the match and returns the match, or None on timeout.
+        '''
+        found = []
+        def ready():
+            if not found:
+                match = pattern.search(self.buf)
+                if (match != None):
+                    found.append(match)
+            return bool(found)
+        if not await self._wait(ready, timeout):
+            return None
+        del self.buf[:found[0].end()]
+        return found[0]
+
+    def flush(self):
+        self.buf.clear()
+
+    async def write(self, data, timeout=None):
+        '''Write all of data, yielding to the loop while the port is full.'''
+        if (self.fd == None):
+            await self.loop.run_in_executor(None, self.ser.write, data)
+            return len(data)
+
+        view = memoryview(data)
+        async def drain():
+            nonlocal view
+            while view:
+                try:
+                    view = view[os.write(self.fd, view):]
+                except BlockingIOError:
+                    writable = self.loop.create_future()
+                    self.loop.add_writer(self.fd, writable.set_result, None)
+                    try:
+                        await writable
+                    finally:
+                        self.loop.remove_writer(self.fd)
+        await asyncio.wait_for(drain(), timeout)
+        return len(data)
+
+    async def send_at_command(self, command):
+        await self.write(bytes(command+"\r", encoding='ascii'))
+
+    def close(self):
+        self.closed = True
+        self.changed.set()
+        if (self.fd != None):
+            self.loop.remove_reader(self.fd)
+        elif (self.poller != None):
+            self.poller.cancel()
+        self.ser.close()
+
+async def open_serial(port, baudrate=DEF_BAUDRATE):
+    '''Open port (8N1, no flow control) as an AsyncSerial.'''
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = baudrate
+    ser.bytesize = serial.EIGHTBITS
+    ser.stopbits = serial.STOPBITS_ONE
+    ser.parity = serial.PARITY_NONE
+    ser.xonxoff = 0
+    ser.rtscts = 0
+    ser.timeout = 0
+    ser.open()
+    ser.flushInput()
+    return AsyncSerial(ser)
+
+class AsyncXMODEM(object):
+    '''
+    XMODEM protocol driver with coroutine send/recv over an AsyncSerial.
+
+    Behaves like ``XMODEMExt`` (including the windowed streaming mode when
+    the receiver opens with ``G``) and ``xmodem.XMODEM.recv``; framing and
+    checksums come from the ``xmodem`` package.  Cancelling a transfer
+    sends CAN CAN to the peer before the cancellation propagates.
+    '''
+
+    def __init__(self, port, mode='xmodem', pad=b'\x1a', window=DEF_WINDOW):
+        self.port = port
+        self.mode = mode
+        self.pad = pad
+        self.window = window
+        self.codec = XMODEMExt(None, None, mode=mode, pad=pad)
+
+    async def abort(self, count=2):
+        await self.port.write(CAN * count)
+
+    async def send(self, stream, retry=16, timeout=DEF_TIMEOUT, callback=None):
+        try:
+            return await self._send(stream, retry, timeout, callback)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.abort())
+            raise
+
+    async def _send(self, stream, retry, timeout, callback):
+        packet_size = PACKET_SIZE[self.mode]
+        counts = {'total': 0, 'success': 0, 'error': 0}
+
+        def report():
+            if callable(callback):
+                callback(counts['total'], counts['success'], counts['error'])
+
+        # start sequence
+        crc_mode = None
+        streaming = False
+        cancel = 0
+        errors = 0
+        while (crc_mode == None):
+            char = await self.port.read(1, timeout)
+            if (char == NAK):
+                crc_mode = 0
+            elif (char == CRC):
+                crc_mode = 1
+            elif (char == GMODE):
+                crc_mode = 1
+                streaming = self.window > 0
+            elif (char == EOT) or ((char == CAN) and cancel):
+                log.info('Transmission canceled at start-sequence')
+                return False
+            else:
+                cancel = (char == CAN)
+                errors += 1
+                if (errors > retry):
+                    await self.abort()
+                    return False
+
+        async def send_packet(packet):
+            while True:
+                await self.port.write(packet)
+                char = await self.port.read(1, timeout)
+                if (char == ACK):
+                    counts['success'] += 1
+                    report()
+                    counts['error'] = 0
+                    return True
+                log.error('send error: expected ACK; got %r for block %d', char, packet[1])
+                counts['error'] += 1
+                report()
+                if (counts['error'] > retry):
+                    await self.abort()
+                    return False
+
+        async def collect_ack(outstanding):
+            nonlocal streaming
+            char = await self.port.read(1, timeout)
+            if (char == ACK):
+                outstanding.popleft()
+                counts['success'] += 1
+                report()
+                return True
+            log.warning('stream error: got %r, falling back to stop-and-wait', char)
+            streaming = False
+            counts['error'] += 1
+            report()
+            self.port.flush()
+            while outstanding:
+                if not await send_packet(outstanding.popleft()):
+                    return False
+            return True
+
+        outstanding = collections.deque()
+        sequence = 1
+        while True:
+            data = stream.read(packet_size)
+            if not data:
+                break
+            counts['total'] += 1
+            data = data.ljust(packet_size, self.pad)
+            packet = (self.codec._make_send_header(packet_size, sequence) + data
+                      + self.codec._make_send_checksum(crc_mode, data))
+            sequence = (sequence + 1) % 0x100
+
+            if not streaming:
+                if not await send_packet(packet):
+                    return False
+                continue
+
+            await self.port.write(packet)
+            outstanding.append(packet)
+            if (len(outstanding) >= self.window):
+                if not await collect_ack(outstanding):
+                    return False
+
+        while outstanding:
+            if not await collect_ack(outstanding):
+                return False
+
+        while True:
+            await self.port.write(EOT)
+            if (await self.port.read(1, timeout) == ACK):
+                return True
+            counts['error'] += 1
+            report()
+            if (counts['error'] > retry):
+                await self.abort()
+                return False
+
+    async def recv(self, stream, crc_mode=1, retry=16, timeout=DEF_TIMEOUT, delay=1, callback=None):
+        try:
+            return await self._recv(stream, crc_mode, retry, timeout, delay, callback)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.abort())
+            raise
+
+    async def _recv(self, stream, crc_mode, retry, timeout, delay, callback):
+        # start sequence: ask for CRC first, fall back to checksum
+        errors = 0
+        while True:
+            if (errors >= retry):
+                await self.abort()
+                return None
+            if crc_mode and (errors < retry // 2):
+                await self.port.write(CRC)
+            else:
+                crc_mode = 0
+                await self.port.write(NAK)
+            char = await self.port.read(1, delay)
+            if char in (SOH, STX):
+                break
+            if (char == CAN) or (char == EOT):
+                return None
+            errors += 1
+
+        income_size = 0
+        sequence = 1
+        total_packets = 0
+        success_count = 0
+        errors = 0
+        while True:
+            if (char == EOT):
+                await self.port.write(ACK)
+                return income_size
+            if (char == CAN):
+                return None
+            if char not in (SOH, STX):
+                errors += 1
+                if (errors > retry):
+                    await self.abort()
+                    return None
+                char = await self.port.read(1, timeout)
+                continue
+
+            packet_size = 128 if (char == SOH) else 1024
+            body = await self.port.read(2 + packet_size + 1 + crc_mode, timeout)
+            valid = False
+            if (body != None) and (len(body) == 2 + packet_size + 1 + crc_mode):
+                seq1, seq2 = body[0], 0xff - body[1]
+                if (seq1 == seq2 == sequence):
+                    valid, data = self.codec._verify_recv_checksum(crc_mode, body[2:])
+                elif (seq1 == seq2 == (sequence - 1) % 0x100):
+                    # duplicate of the last block: our ACK got lost
+                    await self.port.write(ACK)
+                    char = await self.port.read(1, timeout)
+                    continue
+
+            if valid:
+                total_packets += 1
+                success_count += 1
+                if callable(callback):
+                    callback(total_packets, success_count, errors, packet_size)
+                income_size += len(data)
+                stream.write(data)
+                await self.port.write(ACK)
+                sequence = (sequence + 1) % 0x100
+                errors = 0
+            else:
+                # purge the line, then ask for a retransmission
+                while (await self.port.read(1, 1) != None):
+                    pass
+                errors += 1
+                if callable(callback):
+                    callback(total_packets, success_count, errors, packet_size)
+                if (errors > retry):
+                    await self.abort()
+                    return None
+                await self.port.write(NAK)
+            char = await self.port.read(1, timeout)
+
+async def async_send(port, stream, mode='xmodem', window=DEF_WINDOW, timeout=DEF_TIMEOUT, callback=None):
+    '''Send stream over an open AsyncSerial; True on success.'''
+    return await AsyncXMODEM(port, mode=mode, window=window).send(stream, timeout=timeout, callback=callback)
+
+async def async_recv(port, stream, crc_mode=1, timeout=DEF_TIMEOUT, callback=None):
+    '''Receive into stream over an open AsyncSerial; byte count or None.'''
+    return await AsyncXMODEM(port).recv(stream, crc_mode=crc_mode, timeout=timeout, callback=callback)
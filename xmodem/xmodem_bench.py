@@ -0,0 +1,561 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import os
+import sys
+import tty
+import json
+import time
+import math
+import heapq
+import random
+import asyncio
+import argparse
+import binascii
+import resource
+import tempfile
+import threading
+import subprocess
+import xmodem
+from xmodem_ext import XMODEMExt
+from xmodem_async import open_serial, async_send, async_recv
+
+DEF_BAUDRATE = 921600
+DEF_SIZES = '65536,262144'
+DEF_PROTOCOLS = 'xmodem,xmodem1k'
+DEF_RUN_TIMEOUT = 300
+# Longest acceptable wait from the receiver's first start character to
+# block 1; the simulated receiver retries every second
+MAX_FIRST_BLOCK = 0.5
+
+TOOL_DIR = os.path.dirname(os.path.realpath(__file__))
+
+SOH = b'\x01'
+STX = b'\x02'
+EOT = b'\x04'
+ACK = b'\x06'
+NAK = b'\x15'
+CAN = b'\x18'
+
+PROMPT_XMODEM = b"Send data using the xmodem protocol from your terminal\r\n"
+PROMPT_END = b"Do you want to end file transmission and reboot system? (y)\r\n"
+
+class _Pipe(object):
+    '''
+    One direction of the emulated link: chunks are held for their time on
+    the wire at the emulated baud rate plus the latency, possibly get bits
+    flipped, and are then handed to sink in order.
+    '''
+
+    def __init__(self, sink, baudrate, latency, ber, rng):
+        self.sink = sink
+        self.baudrate = baudrate
+        self.latency = latency
+        self.ber = ber
+        self.rng = rng
+        self.queue = []
+        self.seq = 0
+        self.wire_free = 0
+        self.cv = threading.Condition()
+        self.bit_errors = 0
+        self.next_error = self._error_gap()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _error_gap(self):
+        '''Bits until the next flipped bit (geometric distribution).'''
+        if (self.ber <= 0):
+            return math.inf
+        return int(math.log(1 - self.rng.random()) / math.log(1 - self.ber))
+
+    def put(self, data):
+        data = bytearray(data)
+        bit = self.next_error
+        while (bit < len(data) * 8):
+            data[bit // 8] ^= 1 << (bit % 8)
+            self.bit_errors += 1
+            bit += 1 + self._error_gap()
+        self.next_error = bit - len(data) * 8
+        now = time.monotonic()
+        wire_time = (len(data) * 10 / self.baudrate) if self.baudrate else 0
+        with self.cv:
+            self.wire_free = max(self.wire_free, now) + wire_time
+            self.seq += 1
+            heapq.heappush(self.queue, (self.wire_free + self.latency, self.seq, bytes(data)))
+            self.cv.notify()
+
+    def _run(self):
+        while True:
+            with self.cv:
+                while not self.queue:
+                    self.cv.wait()
+                due = self.queue[0][0]
+                now = time.monotonic()
+                if (due > now):
+                    self.cv.wait(due - now)
+                    continue
+                data = heapq.heappop(self.queue)[2]
+            self.sink(data)
+
+class EmulatedLink(object):
+    '''
+    Device end of a Linux pty pair.  The host tool opens ``port``; the
+    device side is driven through read()/write().  Both directions emulate
+    a UART at baudrate (0 = as fast as the pty goes), a one-way latency in
+    seconds and a bit error rate.
+    '''
+
+    def __init__(self, baudrate=DEF_BAUDRATE, latency=0.0, ber=0.0, seed=None):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        rng = random.Random(seed)
+        self.buf = bytearray()
+        self.cv = threading.Condition()
+        self.closed = False
+        self.rx = _Pipe(self._deliver, baudrate, latency, ber, rng)
+        self.tx = _Pipe(self._to_host, baudrate, latency, ber, rng)
+        threading.Thread(target=self._read_master, daemon=True).start()
+
+    def _read_master(self):
+        while True:
+            try:
+                data = os.read(self.master, 65536)
+            except OSError:
+                return
+            self.rx.put(data)
+
+    def _to_host(self, data):
+        # once closed, the fd number may already belong to another link
+        if (not self.closed):
+            os.write(self.master, data)
+
+    def _deliver(self, data):
+        with self.cv:
+            self.buf += data
+            self.cv.notify_all()
+
+    def read(self, size, timeout=1):
+        end = time.monotonic() + timeout
+        with self.cv:
+            while (len(self.buf) < size):
+                remain = end - time.monotonic()
+                if (remain <= 0):
+                    break
+                self.cv.wait(remain)
+            data = bytes(self.buf[:size])
+            del self.buf[:size]
+        return data or None
+
+    def purge(self, quiet=0.05):
+        '''Drop input until the line has been quiet for quiet seconds.'''
+        while (self.read(65536, quiet) != None):
+            pass
+
+    def write(self, data):
+        self.tx.put(data)
+
+    def close(self):
+        self.closed = True
+        os.close(self.master)
+        os.close(self.slave)
+
+class SimBootloader(object):
+    '''
+    Bootloader side for xmodem_send.py: prints the xmodem prompt until '1'
+    arrives, then receives xmodem sessions, asking "end file transmission?"
+    after each one until the host answers 'y' or goes quiet.  The time
+    from the first start character of a session to its first block is
+    kept in ``first_block``.
+    '''
+
+    def __init__(self, link, start=b'C'):
+        self.link = link
+        self.start = start
+        self.files = []
+        self.naks = 0
+        self.first_block = []
+
+    def run(self):
+        while True:
+            self.link.write(b"boot\r\n" + PROMPT_XMODEM)
+            if (self.link.read(1, 0.2) == b'1'):
+                break
+        while True:
+            self.link.purge(0.01)
+            data = self.recv()
+            if (data == None):
+                return
+            self.files.append(data)
+            self.link.write(PROMPT_END)
+            char = self.link.read(1, 30)
+            while char not in (b'n', b'y', None):
+                char = self.link.read(1, 30)
+            if (char != b'n'):
+                return
+
+    def recv(self):
+        start = time.monotonic()
+        while True:
+            self.link.write(self.start)
+            char = self.link.read(1, 1)
+            while (char != None) and (char not in (SOH, STX, EOT)):
+                char = self.link.read(1, 0.2)
+            if (char != None):
+                break
+        self.first_block.append(time.monotonic() - start)
+
+        data = bytearray()
+        sequence = 1
+        while True:
+            if (char == EOT):
+                self.link.write(ACK)
+                return bytes(data)
+            size = 128 if (char == SOH) else 1024
+            body = self.link.read(size + 4, 2)
+            if ((body != None) and (len(body) == size + 4) and (body[1] == 0xff - body[0])
+                    and (binascii.crc_hqx(body[2:2 + size], 0) == int.from_bytes(body[-2:], 'big'))):
+                if (body[0] == sequence & 0xff):
+                    data += body[2:2 + size]
+                    sequence += 1
+                    self.link.write(ACK)
+                elif (body[0] == (sequence - 1) & 0xff):
+                    self.link.write(ACK)
+                else:
+                    self.link.write(CAN * 2)
+                    return None
+            else:
+                self.naks += 1
+                self.link.purge()
+                self.link.write(NAK)
+            char = self.link.read(1, 10)
+            while (char not in (SOH, STX, EOT)):
+                if (char == None):
+                    return None
+                if (char == CAN) and (self.link.read(1, 1) == CAN):
+                    return None
+                # garbled header: drop the rest of the packet and ask again
+                self.naks += 1
+                self.link.purge()
+                self.link.write(NAK)
+                char = self.link.read(1, 10)
+
+class SimSender(object):
+    '''Device side for xmodem_recv.py: sends data once the host asks for it.'''
+
+    def __init__(self, link, data, protocol):
+        self.link = link
+        self.data = data
+        self.size = 1024 if (protocol == 'xmodem1k') else 128
+        self.retransmits = 0
+        self.ok = None
+
+    def run(self):
+        char = self.link.read(1, 30)
+        while char not in (b'C', NAK):
+            if (char == None):
+                self.ok = False
+                return
+            char = self.link.read(1, 30)
+        crc_mode = (char == b'C')
+
+        sequence = 1
+        for pos in range(0, len(self.data), self.size):
+            block = self.data[pos:pos + self.size].ljust(self.size, b'\x1a')
+            if crc_mode:
+                check = binascii.crc_hqx(block, 0).to_bytes(2, 'big')
+            else:
+                check = bytes([sum(block) & 0xff])
+            packet = (SOH if self.size == 128 else STX) + bytes([sequence & 0xff, 0xff - (sequence & 0xff)]) + block + check
+            for _ in range(16):
+                self.link.write(packet)
+                char = self.link.read(1, 10)
+                if (char == ACK):
+                    break
+                self.retransmits += 1
+            else:
+                self.ok = False
+                return
+            sequence += 1
+
+        for _ in range(16):
+            self.link.write(EOT)
+            if (self.link.read(1, 10) == ACK):
+                self.ok = True
+                return
+        self.ok = False
+
+def run_tool(argv, timeout):
+    '''Run one host tool to completion; returns (returncode, wall s, cpu s).'''
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.monotonic()
+    try:
+        proc = subprocess.run([sys.executable] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        returncode = proc.returncode
+    except subprocess.TimeoutExpired:
+        returncode = None
+    wall = time.monotonic() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return returncode, wall, cpu
+
+def load_session(report_path):
+    try:
+        with open(report_path) as f:
+            return json.load(f)['sessions'][-1]
+    except (OSError, ValueError, KeyError, IndexError):
+        return {}
+
+def result_row(direction, protocol, size, ok, wall, cpu, session):
+    duration = session.get('duration_s') or wall
+    return {
+        'direction': direction,
+        'protocol': protocol,
+        'size': size,
+        'ok': ok,
+        'wall_s': round(wall, 3),
+        'transfer_s': round(duration, 3),
+        'bytes_per_s': round(size / duration, 1) if (ok and duration > 0) else 0,
+        'retransmits': session.get('retransmits', 0),
+        'cpu_s_per_mb': round(cpu / (size / 1048576), 3),
+    }
+
+def bench_send(protocol, size, link_args, work_dir, window, stream, timeout):
+    '''xmodem_send.py against SimBootloader.'''
+    data = os.urandom(size)
+    image = os.path.join(work_dir, 'image.bin')
+    report = os.path.join(work_dir, 'send_report.json')
+    with open(image, 'wb') as f:
+        f.write(data)
+
+    link = EmulatedLink(**link_args)
+    device = SimBootloader(link, start=b'G' if stream else b'C')
+    threading.Thread(target=device.run, daemon=True).start()
+
+    returncode, wall, cpu = run_tool([os.path.join(TOOL_DIR, 'xmodem_send.py'), '--port', link.port,
+                                      '--file', image, '--protocol', protocol, '--window', str(window),
+                                      '--ledger', os.path.join(work_dir, 'ledger.json'),
+                                      '--report', report, '--exit'], timeout)
+    link.close()
+
+    ok = (returncode == 0) and (len(device.files) > 0) and (device.files[0][:size] == data)
+    row = result_row('send', protocol, size, ok, wall, cpu, load_session(report))
+    # A start character the host misses costs a whole receiver retry
+    # period before block 1 goes out
+    row['first_block_s'] = round(max(device.first_block or [0]), 3)
+    if (row['first_block_s'] > MAX_FIRST_BLOCK):
+        row['ok'] = False
+    return row
+
+def bench_recv(protocol, size, link_args, work_dir, timeout):
+    '''xmodem_recv.py against SimSender.'''
+    data = os.urandom(size)
+    output = os.path.join(work_dir, 'received.bin')
+    report = os.path.join(work_dir, 'recv_report.json')
+
+    link = EmulatedLink(**link_args)
+    device = SimSender(link, data, protocol)
+    threading.Thread(target=device.run, daemon=True).start()
+
+    returncode, wall, cpu = run_tool([os.path.join(TOOL_DIR, 'xmodem_recv.py'), '--port', link.port,
+                                      '--file', output, '--timeout', '2',
+                                      '--report', report, '--exit'], timeout)
+    link.close()
+
+    with open(output, 'rb') as f:
+        received = f.read()
+    ok = (returncode == 0) and device.ok and (received[:size] == data)
+    row = result_row('recv', protocol, size, ok, wall, cpu, load_session(report))
+    row['retransmits'] = device.retransmits
+    return row
+
+def bench_async(direction, protocol, size, link_args, ports, window, stream, timeout):
+    '''
+    AsyncXMODEM (xmodem_async) against ports simulated devices at once, all
+    transfers on one event loop in this process.  The CPU time includes
+    the simulated devices, which run in threads of the same process.
+    '''
+    data = os.urandom(size)
+    links = [EmulatedLink(**link_args) for _ in range(ports)]
+    if (direction == 'send'):
+        devices = [SimBootloader(link, start=b'G' if stream else b'C') for link in links]
+        target = lambda device: device.files.append(device.recv())
+    else:
+        devices = [SimSender(link, data, protocol) for link in links]
+        target = SimSender.run
+    threads = [threading.Thread(target=target, args=(device,), daemon=True) for device in devices]
+    for thread in threads:
+        thread.start()
+
+    async def transfer(link):
+        port = await open_serial(link.port)
+        try:
+            if (direction == 'send'):
+                return await async_send(port, io.BytesIO(data), mode=protocol, window=window)
+            output = io.BytesIO()
+            if (await async_recv(port, output) == None):
+                return False
+            return output.getvalue()[:size] == data
+        finally:
+            port.close()
+
+    async def run_all():
+        return await asyncio.wait_for(asyncio.gather(*[transfer(link) for link in links]), timeout)
+
+    start = time.monotonic()
+    cpu = time.process_time()
+    try:
+        results = asyncio.run(run_all())
+    except asyncio.TimeoutError:
+        results = [False]
+    cpu = time.process_time() - cpu
+    wall = time.monotonic() - start
+    # the devices still have to see the last ACK
+    for thread in threads:
+        thread.join(5)
+    for link in links:
+        link.close()
+
+    if (direction == 'send'):
+        received = [(device.files or [None])[0] for device in devices]
+        ok = all(results) and all((image != None) and (image[:size] == data) for image in received)
+        retransmits = sum(device.naks for device in devices)
+    else:
+        ok = all(results) and all(device.ok for device in devices)
+        retransmits = sum(device.retransmits for device in devices)
+    row = result_row('a' + direction, protocol, size * ports, ok, wall, cpu, {})
+    row['ports'] = ports
+    row['retransmits'] = retransmits
+    return row
+
+def bench_checksum(megabytes=1, seed=None):
+    '''
+    CPU seconds per MB of the packet trailer (CRC-16 and sum8) computed by
+    the xmodem package and by XMODEMExt, for 128 and 1K blocks.  Every
+    block is checked to give bit-identical packets.
+    '''
+    rng = random.Random(seed)
+    rows = []
+    for size in (128, 1024):
+        blocks = [bytes(rng.getrandbits(8) for _ in range(size)) for _ in range(64)]
+        count = max(1, int(megabytes * 1048576 / size))
+        engines = [('xmodem', xmodem.XMODEM(None, None)), ('XMODEMExt', XMODEMExt(None, None))]
+        for crc_mode, check in ((1, 'crc16'), (0, 'sum8')):
+            for block in blocks:
+                packets = [bytes(engine._make_send_header(size, 1) + block + engine._make_send_checksum(crc_mode, block))
+                           for _, engine in engines]
+                if (packets[0] != packets[1]):
+                    raise AssertionError("{0} trailer mismatch for a {1} byte block".format(check, size))
+            for name, engine in engines:
+                start = time.process_time()
+                for i in range(count):
+                    engine._make_send_checksum(crc_mode, blocks[i % len(blocks)])
+                cpu = time.process_time() - start
+                rows.append({'engine': name, 'check': check, 'block': size,
+                             'cpu_s_per_mb': round(cpu / (count * size / 1048576), 4)})
+    return rows
+
+def print_table(rows):
+    fmt = "{:<5} {:<9} {:>9} {:>4} {:>8} {:>12} {:>6} {:>9} {:>8}"
+    print(fmt.format('dir', 'protocol', 'size', 'ok', 'time_s', 'bytes/s', 'retx', 'cpu_s/MB', 'first_s'))
+    for row in rows:
+        print(fmt.format(row['direction'], row['protocol'], row['size'], 'yes' if row['ok'] else 'NO',
+                         row['transfer_s'], row['bytes_per_s'], row['retransmits'], row['cpu_s_per_mb'],
+                         row.get('first_block_s', '-')))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark xmodem_send.py / xmodem_recv.py against simulated devices over pty pairs")
+    parser.add_argument("--sizes",
+                        default=DEF_SIZES, type=str,
+                        help="Comma separated transfer sizes in bytes. Default is " + DEF_SIZES)
+    parser.add_argument("--protocols",
+                        default=DEF_PROTOCOLS, type=str,
+                        help="Comma separated protocols. Default is " + DEF_PROTOCOLS)
+    parser.add_argument("--direction",
+                        default='both', choices=['send', 'recv', 'both'],
+                        help="Benchmark xmodem_send.py, xmodem_recv.py or both. Default is both")
+    parser.add_argument("--baudrate",
+                        default=DEF_BAUDRATE, type=lambda x: int(x,0),
+                        help="Emulated UART baud rate, 0 for unthrottled. Default is " + str(DEF_BAUDRATE))
+    parser.add_argument("--latency",
+                        default=0.0, type=float,
+                        help="Emulated one-way latency in seconds. Default is 0")
+    parser.add_argument("--ber",
+                        default=0.0, type=float,
+                        help="Emulated bit error rate. Default is 0")
+    parser.add_argument("--stream", action='store_true',
+                        help="Let the simulated bootloader ask for streaming ('G')")
+    parser.add_argument("--window",
+                        default=16, type=int,
+                        help="--window passed to xmodem_send.py. Default is 16")
+    parser.add_argument("--seed", type=int,
+                        help="Random seed of the bit error injection")
+    parser.add_argument("--run-timeout",
+                        default=DEF_RUN_TIMEOUT, type=int,
+                        help="Give up on one run after this many seconds. Default is " + str(DEF_RUN_TIMEOUT))
+    parser.add_argument("--async", dest='use_async', action='store_true',
+                        help="Benchmark the asyncio driver (xmodem_async) in this process instead of the tools, "
+                             "with --ports transfers sharing one event loop")
+    parser.add_argument("--ports",
+                        default=1, type=int,
+                        help="Simulated devices served at once with --async. Default is 1")
+    parser.add_argument("--checksum", action='store_true',
+                        help="Only run the CRC-16/sum8 micro-benchmark (CPU per MB, xmodem package vs XMODEMExt)")
+    parser.add_argument("--json", type=str,
+                        help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if (args.checksum):
+        rows = bench_checksum(seed=args.seed)
+        fmt = "{:<10} {:<6} {:>6} {:>10}"
+        print(fmt.format('engine', 'check', 'block', 'cpu_s/MB'))
+        for row in rows:
+            print(fmt.format(row['engine'], row['check'], row['block'], row['cpu_s_per_mb']))
+        if (args.json != None):
+            with open(args.json, 'w') as f:
+                json.dump({'checksum': rows}, f, indent=2)
+        sys.exit(0)
+
+    link_args = {'baudrate': args.baudrate, 'latency': args.latency, 'ber': args.ber, 'seed': args.seed}
+    rows = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for protocol in args.protocols.split(','):
+            for size in [int(size, 0) for size in args.sizes.split(',')]:
+                if (args.use_async):
+                    for direction in ('send', 'recv'):
+                        if (args.direction in (direction, 'both')):
+                            rows.append(bench_async(direction, protocol, size, link_args, args.ports,
+                                                    args.window, args.stream, args.run_timeout))
+                    continue
+                if (args.direction in ('send', 'both')):
+                    rows.append(bench_send(protocol, size, link_args, work_dir, args.window, args.stream, args.run_timeout))
+                if (args.direction in ('recv', 'both')):
+                    rows.append(bench_recv(protocol, size, link_args, work_dir, args.run_timeout))
+
+    print_table(rows)
+
+    if (args.json != None):
+        with open(args.json, 'w') as f:
+            json.dump({'link': link_args, 'results': rows}, f, indent=2)
+
+    sys.exit(0 if all(row['ok'] for row in rows) else 1)
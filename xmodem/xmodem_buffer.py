@@ -0,0 +1,108 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import serial
+
+# Largest single read when the driver has more than the protocol asked for
+DEF_CHUNK = 65536
+
+class BufferedReader(object):
+    '''
+    Bulk read layer between a pyserial port and the xmodem getc.
+
+    A read the buffer cannot satisfy takes what it needs and then
+    everything else the driver has waiting (up to ``chunk``), so the header,
+    sequence and payload reads of a block, or an ACK and the console text
+    behind it, usually cost one driver read instead of one each.  The
+    ``timeout`` of every read is honoured (the port timeout is only
+    changed when it differs from the last one) and a read that gets
+    nothing returns None, as the xmodem package expects.
+
+    ``low_latency`` asks the driver to deliver bytes without batching
+    (``ASYNC_LOW_LATENCY``, e.g. a 1 ms FTDI latency timer), where
+    pyserial supports it.  ``syscalls`` counts the driver calls made
+    (reads, in_waiting queries and timeout changes).
+    '''
+
+    def __init__(self, ser, low_latency=False, chunk=DEF_CHUNK, log=print):
+        self.ser = ser
+        self.chunk = chunk
+        self.buf = bytearray()
+        self.syscalls = 0
+        self.reads = 0
+        self.bytes = 0
+        self.low_latency = False
+
+        if low_latency:
+            try:
+                ser.set_low_latency_mode(True)
+                self.low_latency = True
+            except (AttributeError, NotImplementedError, ValueError, OSError, serial.SerialException) as e:
+                log("low latency mode not available:", e)
+
+    def _set_timeout(self, timeout):
+        if (timeout != None) and (timeout != self.ser.timeout):
+            self.ser.timeout = timeout
+            self.syscalls += 1
+
+    def _fill(self, needed, timeout):
+        '''Read at least needed bytes (or until timeout) plus whatever else is waiting.'''
+        self._set_timeout(timeout)
+        data = self.ser.read(needed)
+        self.syscalls += 2
+        self.reads += 1
+        if (len(data) == needed):
+            # the rest of a block usually arrived with its first bytes
+            waiting = min(self.ser.in_waiting, self.chunk)
+            if (waiting > 0):
+                data += self.ser.read(waiting)
+                self.syscalls += 1
+                self.reads += 1
+        self.bytes += len(data)
+        self.buf += data
+        return len(data)
+
+    def read(self, size, timeout=None):
+        '''Up to size bytes; fewer only on timeout, None if nothing arrived.'''
+        if (len(self.buf) < size):
+            self._fill(size - len(self.buf), timeout)
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data or None
+
+    def read_some(self, timeout=None):
+        '''Everything buffered, or else at least one byte if it arrives in time.'''
+        if (len(self.buf) == 0):
+            self._fill(1, timeout)
+        data = bytes(self.buf)
+        self.buf.clear()
+        return data
+
+    def flush(self):
+        self.buf.clear()
+        self.ser.flushInput()
+        self.syscalls += 1
+
+    def report(self, blocks):
+        per_block = (self.syscalls / blocks) if (blocks > 0) else 0.0
+        return "read: {0} syscalls, {1} reads, {2} bytes, {3:.2f} syscalls per block{4}".format(
+            self.syscalls, self.reads, self.bytes, per_block, ", low latency" if self.low_latency else "")
@@ -0,0 +1,271 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import glob
+import gzip
+import time
+import threading
+
+DEF_RING_SIZE = 4 * 1024 * 1024
+DEF_MAX_BYTES = 64 * 1024 * 1024
+DEF_TS_RESOLUTION = 0.001
+READ_TIMEOUT = 0.05
+# longer output without a line break goes to on_line in pieces of this size
+MAX_LINE = 4096
+
+class RingBuffer(object):
+    '''
+    Fixed size byte ring between the serial reader and the log writer.
+
+    ``put()`` never blocks: when the writer falls behind by more than the
+    ring size, the new bytes are dropped and counted.  Every put is tagged
+    with a monotonic timestamp; puts closer together than ``resolution``
+    seconds share the timestamp of the first one.
+    '''
+
+    def __init__(self, size=DEF_RING_SIZE, resolution=DEF_TS_RESOLUTION):
+        self.buf = bytearray(size)
+        self.size = size
+        self.resolution = resolution
+        self.head = 0           # total bytes put
+        self.tail = 0           # total bytes taken
+        self.marks = []         # (stream offset, timestamp)
+        self.dropped = 0
+        self.high_water = 0
+        self.closed = False
+        self.cv = threading.Condition()
+
+    def put(self, data, ts):
+        with self.cv:
+            length = len(data)
+            if (self.head - self.tail + length > self.size):
+                self.dropped += length
+                return False
+            if (len(self.marks) == 0) or (ts - self.marks[-1][1] >= self.resolution):
+                self.marks.append((self.head, ts))
+            pos = self.head % self.size
+            first = min(length, self.size - pos)
+            self.buf[pos:pos + first] = data[:first]
+            self.buf[:length - first] = data[first:]
+            self.head += length
+            self.high_water = max(self.high_water, self.head - self.tail)
+            self.cv.notify()
+            return True
+
+    def get(self, timeout=None):
+        '''
+        Take everything buffered.  Returns (stream offset, data, marks) or
+        None once the ring is closed and empty.
+        '''
+        with self.cv:
+            if (self.head == self.tail) and not self.closed:
+                self.cv.wait(timeout)
+            if (self.head == self.tail):
+                return None if self.closed else (self.tail, b'', [])
+            start, length = self.tail, self.head - self.tail
+            pos = start % self.size
+            first = min(length, self.size - pos)
+            data = bytes(self.buf[pos:pos + first]) + bytes(self.buf[:length - first])
+            marks, self.marks = self.marks, []
+            self.tail = self.head
+        return start, data, marks
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+
+class RotatingCapture(object):
+    '''
+    Raw byte log split into segments ``<prefix>.<n>.bin`` (``.bin.gz`` when
+    compressed) of at most ``max_bytes`` each.  Next to every segment an
+    index ``<prefix>.<n>.idx`` lists "offset monotonic_ts" per chunk, the
+    offset counted in uncompressed bytes from the start of the segment.
+    With ``max_files`` set, the oldest segments are removed.
+    '''
+
+    def __init__(self, prefix, max_bytes=DEF_MAX_BYTES, max_files=0, compress=False):
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.compress = compress
+        self.segments = []
+        self.written = 0
+        self._seq = 0
+        self._file = None
+        self._index = None
+        self._size = 0
+        self._last_ts = 0.0
+
+        directory = os.path.dirname(prefix)
+        if (directory != ''):
+            os.makedirs(directory, exist_ok=True)
+        # continue numbering after segments of a previous capture
+        for name in glob.glob(glob.escape(prefix) + '.*.idx'):
+            try:
+                self._seq = max(self._seq, int(name[len(prefix) + 1:-4]) + 1)
+            except ValueError:
+                pass
+
+    def _open(self):
+        base = '{0}.{1:04d}'.format(self.prefix, self._seq)
+        self._seq += 1
+        if self.compress:
+            name = base + '.bin.gz'
+            self._file = gzip.open(name, 'wb', compresslevel=1)
+        else:
+            name = base + '.bin'
+            self._file = open(name, 'wb')
+        self._index = open(base + '.idx', 'w')
+        self._index.write("# monotonic {0:.6f} = time {1:.6f}\n".format(time.monotonic(), time.time()))
+        self._size = 0
+        self.segments.append((name, base + '.idx'))
+
+        while (self.max_files > 0) and (len(self.segments) > self.max_files):
+            for old in self.segments.pop(0):
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def _rotate(self):
+        self._file.close()
+        self._index.close()
+        self._file = None
+
+    def write(self, offset, data, marks):
+        '''Append data that starts at stream offset, with its (offset, ts) marks.'''
+        pos = 0
+        marks = list(marks)
+        while (pos < len(data)):
+            if (self._file == None):
+                self._open()
+                # every segment starts with a timestamp
+                if (len(marks) == 0) or (marks[0][0] > offset + pos):
+                    marks.insert(0, (offset + pos, self._last_ts))
+            room = self.max_bytes - self._size
+            chunk = data[pos:pos + room]
+            end = offset + pos + len(chunk)
+            while (len(marks) > 0) and (marks[0][0] < end):
+                mark_offset, ts = marks.pop(0)
+                self._index.write("{0} {1:.6f}\n".format(self._size + mark_offset - offset - pos, ts))
+                self._last_ts = ts
+            self._file.write(chunk)
+            self._size += len(chunk)
+            self.written += len(chunk)
+            pos += len(chunk)
+            if (self._size >= self.max_bytes):
+                self._rotate()
+
+    def flush(self):
+        if (self._file != None):
+            self._file.flush()
+            self._index.flush()
+
+    def close(self):
+        if (self._file != None):
+            self._rotate()
+
+class SerialCapture(object):
+    '''
+    Binary-safe capture of a serial port.
+
+    A reader thread pulls whatever bytes the driver has (``in_waiting``,
+    at least one) into a RingBuffer, and a writer thread drains the ring
+    into a RotatingCapture, so slow disks or compression never stall the
+    port.  The writer thread also splits the bytes into lines for
+    ``on_line(text)`` if one is given.
+    '''
+
+    def __init__(self, ser, prefix, ring_size=DEF_RING_SIZE, max_bytes=DEF_MAX_BYTES,
+                 max_files=0, compress=False, resolution=DEF_TS_RESOLUTION, flush_interval=1.0, on_line=None):
+        self.ser = ser
+        self.on_line = on_line
+        self.partial = b''
+        self.ring = RingBuffer(ring_size, resolution)
+        self.log = RotatingCapture(prefix, max_bytes, max_files, compress)
+        self.flush_interval = flush_interval
+        self.received = 0
+        self.reads = 0
+        self.start_time = None
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.ser.timeout = READ_TIMEOUT
+        self._reader.start()
+        self._writer.start()
+
+    def _read_loop(self):
+        ser = self.ser
+        while not self._stop.is_set():
+            try:
+                data = ser.read(ser.in_waiting or 1)
+            except Exception as e:
+                print("Capture read fail:", e)
+                break
+            if data:
+                self.ring.put(data, time.monotonic())
+                self.received += len(data)
+                self.reads += 1
+        self.ring.close()
+
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            item = self.ring.get(self.flush_interval)
+            if (item == None):
+                break
+            self.log.write(*item)
+            if (self.on_line != None):
+                self._lines(item[1])
+            if (time.monotonic() - last_flush >= self.flush_interval):
+                self.log.flush()
+                last_flush = time.monotonic()
+        self.log.close()
+
+    def _lines(self, data):
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        while (len(self.partial) > MAX_LINE):
+            lines.append(self.partial[:MAX_LINE])
+            self.partial = self.partial[MAX_LINE:]
+        for line in lines:
+            self.on_line(line.rstrip(b'\r').decode('utf-8', errors='replace'))
+
+    def stop(self):
+        self._stop.set()
+        self._reader.join()
+        self._writer.join()
+
+    def alive(self):
+        return self._reader.is_alive()
+
+    def report(self):
+        elapsed = time.monotonic() - self.start_time
+        return ("capture: {0} bytes in {1:.1f} s ({2:.1f} bytes/s), {3} reads, {4} written, "
+                "{5} dropped, ring high water {6}/{7}").format(
+                    self.received, elapsed, self.received / elapsed if elapsed > 0 else 0.0,
+                    self.reads, self.log.written, self.ring.dropped, self.ring.high_water, self.ring.size)
@@ -0,0 +1,412 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import binascii
+import collections
+import xmodem
+from xmodem import EOT, ACK, NAK, CAN, CRC
+
+# Receiver start character asking for streaming (XMODEM-1K-G style) transfer
+GMODE = b'G'
+
+DEF_WINDOW = 16
+
+# Adaptive block size: memory of the error rate estimate (per attempt
+# decay), smoothing of the measured times, attempts between decisions and
+# the goodput gain needed to switch
+DEF_DECAY = 0.98
+DEF_SMOOTH = 0.2
+DEF_MIN_ATTEMPTS = 8
+DEF_MARGIN = 1.1
+
+SMALL_BLOCK = 128
+LARGE_BLOCK = 1024
+# SOH/STX, seq, ~seq and CRC-16 around every block
+BLOCK_OVERHEAD = 5
+
+def crc16(data, crc=0):
+    '''
+    CRC-16/XMODEM (poly 0x1021) of data, continuing from crc.  Same value as
+    ``xmodem.XMODEM.calc_crc`` but computed in C by ``binascii.crc_hqx``.
+    '''
+    return binascii.crc_hqx(data, crc)
+
+def sum8(data, checksum=0):
+    '''8 bit additive checksum, same value as ``xmodem.XMODEM.calc_checksum``.'''
+    return (sum(data) + checksum) & 0xff
+
+def make_checksum(crc_mode, data):
+    '''Trailer of one packet: big endian CRC-16, or the sum8 byte.'''
+    if crc_mode:
+        return crc16(data).to_bytes(2, 'big')
+    return bytes([sum8(data)])
+
+class BlockSizeController(object):
+    '''
+    Chooses between 128 byte (SOH) and 1K (STX) blocks from what the
+    transfer observes.
+
+    Every attempt feeds ``record(ok, elapsed)``.  The controller keeps a
+    decaying failure rate per block size, which gives the byte error rate
+    p through (1 - p) ** n for n byte frames, the time of a good attempt
+    per block size and the time a failed attempt costs (NAK or timeout
+    plus the receiver's recovery).  With p the success chance and the expected
+    payload bytes/s of either size follow.  After ``min_attempts`` at one
+    size it switches when the other size promises ``margin`` times more.
+
+    The good attempt time of a size not seen yet is derived from the
+    current one with ``byte_time`` (seconds per byte on the wire, 10 /
+    baud rate); without it the time is taken as proportional to the
+    frame size.  ``on_resize(old, new)`` is called on every switch.
+    '''
+
+    def __init__(self, size=LARGE_BLOCK, byte_time=None, decay=DEF_DECAY, smooth=DEF_SMOOTH,
+                 min_attempts=DEF_MIN_ATTEMPTS, margin=DEF_MARGIN, on_resize=None):
+        self.size = size
+        self.byte_time = byte_time
+        self.decay = decay
+        self.smooth = smooth
+        self.min_attempts = min_attempts
+        self.margin = margin
+        self.on_resize = on_resize
+        self.fails = {}
+        self.tries = {}
+        self.ok_time = {}
+        self.fail_time = None
+        self.attempts = 0
+        self.resizes = 0
+
+    def _average(self, old, new):
+        return new if (old == None) else old + self.smooth * (new - old)
+
+    def error_rate(self):
+        '''Estimated byte error rate, weighted over the block sizes tried.'''
+        total, rate = 0.0, 0.0
+        for size, tries in self.tries.items():
+            if (tries <= 0):
+                continue
+            # keep a frame some chance to pass, all-fail windows happen
+            failed = min(self.fails[size] / tries, 0.99)
+            rate += tries * (1 - (1 - failed) ** (1.0 / (size + BLOCK_OVERHEAD)))
+            total += tries
+        return (rate / total) if (total > 0) else 0.0
+
+    def _good_time(self, size):
+        if (size in self.ok_time):
+            return self.ok_time[size]
+        if (self.size not in self.ok_time):
+            return None
+        current = self.ok_time[self.size]
+        frame, current_frame = size + BLOCK_OVERHEAD, self.size + BLOCK_OVERHEAD
+        if (self.byte_time == None):
+            return current * frame / current_frame
+        return max(0.0, current + (frame - current_frame) * self.byte_time)
+
+    def goodput(self, size):
+        '''Expected payload bytes/s with size byte blocks, None if unknown.'''
+        good_time = self._good_time(size)
+        if (good_time == None):
+            return None
+        frame_ok = (1 - self.error_rate()) ** (size + BLOCK_OVERHEAD)
+        fail_time = self.fail_time if (self.fail_time != None) else good_time
+        elapsed = frame_ok * good_time + (1 - frame_ok) * fail_time
+        if (elapsed <= 0):
+            return None
+        return size * frame_ok / elapsed
+
+    def record(self, ok, elapsed=None):
+        '''Feed the outcome of one block attempt, returns the block size to use next.'''
+        for size in self.tries:
+            self.fails[size] *= self.decay
+            self.tries[size] *= self.decay
+        self.fails[self.size] = self.fails.get(self.size, 0.0) + (0 if ok else 1)
+        self.tries[self.size] = self.tries.get(self.size, 0.0) + 1
+        if (elapsed != None):
+            if ok:
+                self.ok_time[self.size] = self._average(self.ok_time.get(self.size), elapsed)
+            else:
+                self.fail_time = self._average(self.fail_time, elapsed)
+        self.attempts += 1
+
+        if (self.attempts >= self.min_attempts):
+            other = SMALL_BLOCK if (self.size == LARGE_BLOCK) else LARGE_BLOCK
+            current_rate, other_rate = self.goodput(self.size), self.goodput(other)
+            if (current_rate != None) and (other_rate != None) and (other_rate > current_rate * self.margin):
+                old, self.size = self.size, other
+                self.attempts = 0
+                self.resizes += 1
+                if callable(self.on_resize):
+                    self.on_resize(old, other)
+        return self.size
+
+class XMODEMExt(xmodem.XMODEM):
+    '''
+    XMODEM sender with a streaming mode.
+
+    When the receiver starts the session with ``G`` instead of ``C``/``NAK``,
+    blocks are sent back to back without waiting for each ACK.  Up to
+    ``window`` blocks may be outstanding; ACKs are collected in order as the
+    window fills.  The first NAK, garbled reply or timeout drops the transfer
+    back to stop-and-wait, resending from the oldest unacknowledged block.
+    A receiver answering ``C`` or ``NAK`` gets a plain stop-and-wait
+    transfer, exactly as with ``xmodem.XMODEM``.
+
+    CRC-16 and sum8 are computed by ``crc16()``/``sum8()`` instead of the
+    per-byte Python loop of the xmodem package, for both sending and
+    receiving; the packets are bit-identical.
+
+    :param window: Maximum number of unacknowledged blocks in streaming mode.
+        ``0`` disables streaming; a ``G`` is then treated like ``C``.
+    :type window: int
+    :param flush: Optional callable discarding pending input, used to drop
+        stale replies before falling back to stop-and-wait.
+    :type flush: callable
+    :param controller: Optional BlockSizeController.  Each block then takes
+        its size from the controller, mixing SOH and STX blocks in one
+        session; a 1K block still failing after a switch to 128 bytes is
+        resent as 128 byte blocks.
+    :type controller: BlockSizeController
+    '''
+
+    def __init__(self, getc, putc, mode='xmodem', pad=b'\x1a', window=DEF_WINDOW, flush=None, controller=None):
+        super().__init__(getc, putc, mode=mode, pad=pad)
+        self.window = window
+        self.flush = flush
+        self.controller = controller
+        self.streaming = False
+        self.acked_bytes = 0
+
+    def calc_crc(self, data, crc=0):
+        return crc16(data, crc)
+
+    def calc_checksum(self, data, checksum=0):
+        return sum8(data, checksum)
+
+    def _make_send_checksum(self, crc_mode, data):
+        return make_checksum(crc_mode, data)
+
+    def send(self, stream, retry=16, timeout=60, quiet=False, callback=None, adaptive=True):
+        '''
+        Send a stream via the XMODEM protocol, streaming when the receiver
+        asks for it.  Arguments and return value match ``xmodem.XMODEM.send``;
+        ``adaptive=False`` keeps the mode's block size even with a
+        controller.  ``acked_bytes`` counts the payload bytes acknowledged.
+        '''
+        try:
+            packet_size = dict(
+                xmodem    = 128,
+                xmodem1k  = 1024,
+            )[self.mode]
+        except KeyError:
+            raise ValueError("Invalid mode specified: {self.mode!r}"
+                             .format(self=self))
+
+        self.total_packets = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.acked_bytes = 0
+        self._adapt = adaptive and (self.controller != None)
+        carry = b''
+
+        start = self._send_start(retry, timeout, quiet)
+        if start is None:
+            return False
+        crc_mode, self.streaming = start
+        outstanding = collections.deque()
+        sequence = 1
+
+        while True:
+            if self._adapt:
+                packet_size = self.controller.size
+            data = carry[:packet_size]
+            carry = carry[packet_size:]
+            if (len(data) < packet_size):
+                data += stream.read(packet_size - len(data))
+            if not data:
+                self.log.debug('send: at EOF')
+                break
+            self.total_packets += 1
+
+            header = self._make_send_header(packet_size, sequence)
+            packet = header + data.ljust(packet_size, self.pad)
+            packet += self._make_send_checksum(crc_mode, packet[3:])
+
+            if not self.streaming:
+                result = self._send_packet(packet, retry, timeout, callback, len(data))
+                if result is None:
+                    # block size dropped while this block failed: split it
+                    self.total_packets -= 1
+                    carry = data + carry
+                    continue
+                if not result:
+                    return False
+                sequence = (sequence + 1) % 0x100
+                continue
+
+            sequence = (sequence + 1) % 0x100
+
+            self.log.debug('send: stream block %d', packet[1])
+            self.putc(packet)
+            outstanding.append((packet, len(data)))
+
+            if len(outstanding) >= self.window:
+                if not self._collect_ack(outstanding, retry, timeout, callback):
+                    return False
+
+        # drain the window before closing the session
+        while outstanding:
+            if not self._collect_ack(outstanding, retry, timeout, callback):
+                return False
+
+        return self._send_eot(retry, timeout, callback)
+
+    def _send_start(self, retry, timeout, quiet):
+        '''
+        Wait for the receiver's start character.  Returns ``(crc_mode,
+        streaming)`` or ``None`` when the session was cancelled.
+        '''
+        error_count = 0
+        cancel = 0
+        while True:
+            char = self.getc(1)
+            if char:
+                if char == NAK:
+                    self.log.debug('standard checksum requested (NAK).')
+                    return 0, False
+                elif char == CRC:
+                    self.log.debug('16-bit CRC requested (CRC).')
+                    return 1, False
+                elif char == GMODE:
+                    self.log.debug('streaming requested (G), window=%d.', self.window)
+                    return 1, self.window > 0
+                elif char == CAN:
+                    if not quiet:
+                        print('received CAN', file=sys.stderr)
+                    if cancel:
+                        self.log.info('Transmission canceled: received CAN CAN '
+                                      'at start-sequence')
+                        return None
+                    self.log.debug('received CAN at start of sequence.')
+                    cancel = 1
+                elif char == EOT:
+                    self.log.info('Transmission canceled: received EOT '
+                                  'at start-sequence')
+                    return None
+                else:
+                    self.log.error('send error: expected NAK, CRC, G, EOT or CAN; '
+                                   'got %r', char)
+
+            error_count += 1
+            if error_count > retry:
+                self.log.error('send error: error_count reached %d, '
+                               'aborting.', retry)
+                self.abort(timeout=timeout)
+                return None
+
+    def _send_packet(self, packet, retry, timeout, callback, length, split=True):
+        '''
+        Stop-and-wait: emit one packet until it is ACKed.  Returns None
+        instead of retrying when the controller dropped below the packet's
+        size and split is allowed.
+        '''
+        while True:
+            self.log.debug('send: block %d', packet[1])
+            start = time.monotonic()
+            self.putc(packet)
+            char = self.getc(1, timeout)
+            if self._adapt:
+                self.controller.record(char == ACK, time.monotonic() - start)
+            if char == ACK:
+                self.success_count += 1
+                self.acked_bytes += length
+                if callable(callback):
+                    callback(self.total_packets, self.success_count, self.error_count)
+                self.error_count = 0
+                return True
+
+            self.log.error('send error: expected ACK; got %r for block %d',
+                           char, packet[1])
+            self.error_count += 1
+            if callable(callback):
+                callback(self.total_packets, self.success_count, self.error_count)
+            if self.error_count > retry:
+                self.log.error('send error: NAK received %d times, '
+                               'aborting.', self.error_count)
+                self.abort(timeout=timeout)
+                return False
+            if split and self._adapt and (self.controller.size < len(packet) - 5):
+                self.log.info('send: block %d resent as %d byte blocks',
+                              packet[1], self.controller.size)
+                return None
+
+    def _collect_ack(self, outstanding, retry, timeout, callback):
+        '''
+        Streaming: consume the ACK of the oldest outstanding block.  On any
+        other reply, fall back to stop-and-wait and resend the whole window.
+        '''
+        char = self.getc(1, timeout)
+        if self._adapt:
+            self.controller.record(char == ACK)
+        if char == ACK:
+            self.acked_bytes += outstanding.popleft()[1]
+            self.success_count += 1
+            if callable(callback):
+                callback(self.total_packets, self.success_count, self.error_count)
+            return True
+
+        self.log.warning('stream error: expected ACK; got %r for block %d, '
+                         'falling back to stop-and-wait', char, outstanding[0][0][1])
+        self.streaming = False
+        self.error_count += 1
+        if callable(callback):
+            callback(self.total_packets, self.success_count, self.error_count)
+        if callable(self.flush):
+            self.flush()
+
+        # blocks after the failed one are already numbered, keep their size
+        while outstanding:
+            packet, length = outstanding.popleft()
+            if not self._send_packet(packet, retry, timeout, callback, length, split=False):
+                return False
+        return True
+
+    def _send_eot(self, retry, timeout, callback):
+        while True:
+            self.log.debug('sending EOT, awaiting ACK')
+            self.putc(EOT)
+
+            char = self.getc(1, timeout)
+            if char == ACK:
+                break
+            self.log.error('send error: expected ACK; got %r', char)
+            self.error_count += 1
+            if callable(callback):
+                callback(self.total_packets, self.success_count, self.error_count)
+            if self.error_count > retry:
+                self.log.warning('EOT was not ACKd, aborting transfer')
+                self.abort(timeout=timeout)
+                return False
+
+        self.log.info('Transmission successful (ACK received).')
+        return True
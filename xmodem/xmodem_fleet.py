@@ -0,0 +1,143 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import glob
+import time
+import threading
+import traceback
+import concurrent.futures
+from xmodem_session import LogBuffer
+
+DEF_JOBS = 4
+
+def expand_ports(port_spec):
+    '''
+    Expand a --port value into a list of ports.  The value may be a comma
+    separated list, and each item may be a glob pattern (/dev/ttyACM*).
+    '''
+    ports = []
+    for item in port_spec.split(','):
+        item = item.strip()
+        if (item == ''):
+            continue
+        if glob.has_magic(item):
+            ports += sorted(glob.glob(item))
+        else:
+            ports.append(item)
+    # keep order, drop duplicates
+    return list(dict.fromkeys(ports))
+
+def is_fleet(port_spec):
+    return (',' in port_spec) or glob.has_magic(port_spec)
+
+def port_name(port):
+    '''port as a file name part: /dev/ttyACM0 -> dev_ttyACM0'''
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', port.strip('/\\'))
+
+def port_log_name(port):
+    return port_name(port) + '.log'
+
+def port_file_name(path, port):
+    '''
+    Per-port variant of a file option, so the boards of a fleet do not
+    share one file: report.json -> report.dev_ttyACM0.json
+    '''
+    stem, ext = os.path.splitext(path)
+    return "{0}.{1}{2}".format(stem, port_name(port), ext)
+
+def run_port(make_session, port, timeout, log_dir):
+    '''
+    Run one transfer session for port in the calling thread, returns its
+    result dict.  make_session(port, log=log) builds the session.  Any
+    exception fails this port only, with the traceback in its output.
+    '''
+    start = time.monotonic()
+    log = LogBuffer()
+    session = None
+    timer = None
+
+    try:
+        session = make_session(port, log=log)
+        if (timeout != None):
+            timer = threading.Timer(timeout, session.abort)
+            timer.daemon = True
+            timer.start()
+        ok = session.run()
+        status = 'ok' if ok else 'fail'
+    except Exception:
+        log(traceback.format_exc())
+        ok = False
+        status = 'error'
+    finally:
+        if (timer != None):
+            timer.cancel()
+
+    if (session != None) and session.aborted:
+        ok = False
+        status = 'timeout'
+
+    elapsed = time.monotonic() - start
+    output = log.getvalue()
+
+    if (log_dir != None):
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            with open(os.path.join(log_dir, port_log_name(port)), 'w') as f:
+                f.write(output)
+        except OSError as e:
+            output += "log write fail: {0}\n".format(e)
+
+    return {'port': port, 'ok': ok, 'status': status, 'bytes': session.total_bytes if (session != None) else 0,
+            'elapsed': elapsed, 'output': output}
+
+def run_fleet(make_session, ports, jobs=DEF_JOBS, timeout=None, log_dir=None):
+    '''
+    Flash every port with its own session (see xmodem_session), at most
+    jobs at a time, all in this process.  Each board runs independently, so
+    a failed or stuck board only costs its own worker thread.  Returns True
+    if every board succeeded.
+    '''
+    print("fleet: {0} port(s), {1} worker(s)".format(len(ports), jobs))
+    results = []
+    start = time.monotonic()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_port, make_session, port, timeout, log_dir) for port in ports]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print("fleet: {0} {1} {2} bytes in {3:.1f}s".format(
+                result['port'], result['status'], result['bytes'], result['elapsed']))
+            if (not result['ok']):
+                for line in result['output'].splitlines()[-10:]:
+                    print("    " + line.split('\r')[-1])
+
+    elapsed = time.monotonic() - start
+    total_bytes = sum(result['bytes'] for result in results)
+    passed = sum(1 for result in results if result['ok'])
+
+    print("fleet: {0}/{1} ok, {2} bytes in {3:.1f}s, aggregate {4:.0f} bytes/s".format(
+        passed, len(results), total_bytes, elapsed, total_bytes / elapsed if elapsed > 0 else 0))
+
+    return passed == len(results)
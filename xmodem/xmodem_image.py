@@ -0,0 +1,157 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import os
+import mmap
+
+# Single model preamble: C0 5A | position | offset | 5A C0, one packet of 0xFF fill
+PREAMBLE_HEAD = bytes([0xC0, 0x5A])
+PREAMBLE_TAIL = bytes([0x5A, 0xC0])
+
+FILL = 0xFF
+
+def parse_model_arg(model):
+    '''
+    Split a --model "bin_file flash_address_hex offset_hex" argument into
+    (file, position, offset).  Returns None if the argument is malformed.
+    '''
+    model_arg = model.split(" ")
+
+    if (len(model_arg) < 2) :
+        return None
+
+    model_position = int(model_arg[1], 16)
+    model_offset = 0
+    if (len(model_arg) > 2) :
+        model_offset = int(model_arg[2], 16)
+
+    return model_arg[0], model_position, model_offset
+
+def packet_count(length, packet_size):
+    '''Number of xmodem packets needed for length bytes.'''
+    return -(-length // packet_size)
+
+def fill_bytes(length, packet_size):
+    '''0xFF fill needed to pad length bytes up to a packet boundary.'''
+    return bytes([FILL]) * (-length % packet_size)
+
+def make_preamble(position, offset, packet_size):
+    '''
+    Build the one-packet preamble announcing the flash position and offset
+    of the next model, as an in-memory stream.
+    '''
+    header = PREAMBLE_HEAD + position.to_bytes(4, 'little') + offset.to_bytes(4, 'little') + PREAMBLE_TAIL
+    return io.BytesIO(header + fill_bytes(len(header), packet_size))
+
+class ImageStream(object):
+    '''
+    Read-only stream over a sequence of buffers.
+
+    Files are mapped with a read-only mmap and served through memoryview
+    slices, so nothing is copied into Python memory until ``read()`` hands a
+    block to the xmodem sender.  ``len()`` gives the total size in bytes.
+    '''
+
+    def __init__(self):
+        self._maps = []
+        self._views = []
+        self._idx = 0
+        self._pos = 0
+
+    def __len__(self):
+        return sum(view.nbytes for view in self._views)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, data):
+        '''Append an in-memory buffer.'''
+        if (len(data) > 0):
+            self._views.append(memoryview(data).cast('B'))
+
+    def append_file(self, path):
+        '''Append a file through a read-only mapping, returns its size.'''
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap refuses empty files; they contribute nothing anyway
+            if (size == 0):
+                return 0
+            image_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(image_map)
+        self._views.append(memoryview(image_map))
+        return size
+
+    def seek(self, offset):
+        '''Move to an absolute offset from the start of the stream.'''
+        self._idx = 0
+        self._pos = 0
+        for view in self._views:
+            if (offset < view.nbytes):
+                break
+            offset -= view.nbytes
+            self._idx += 1
+        self._pos = offset if (self._idx < len(self._views)) else 0
+        return self.tell()
+
+    def tell(self):
+        return sum(view.nbytes for view in self._views[:self._idx]) + self._pos
+
+    def read(self, size=-1):
+        chunks = []
+        while (size != 0) and (self._idx < len(self._views)):
+            view = self._views[self._idx]
+            end = view.nbytes if (size < 0) else min(view.nbytes, self._pos + size)
+            chunks.append(view[self._pos:end])
+            if (size > 0):
+                size -= end - self._pos
+            self._pos = end
+            if (self._pos >= view.nbytes):
+                self._idx += 1
+                self._pos = 0
+        return b''.join(chunks)
+
+    def update(self, digest):
+        '''Feed the whole content to a hashlib object, in place.'''
+        for view in self._views:
+            digest.update(view)
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        for image_map in self._maps:
+            image_map.close()
+        self._views = []
+        self._maps = []
+
+def open_image(path):
+    '''Open an image file as an ImageStream.'''
+    stream = ImageStream()
+    try:
+        stream.append_file(path)
+    except:
+        stream.close()
+        raise
+    return stream
@@ -0,0 +1,207 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import hashlib
+import threading
+import contextlib
+from xmodem_image import parse_model_arg, open_image
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEF_STATE_DIR = os.path.join(os.path.expanduser('~'), '.himax_xmodem')
+DEF_LEDGER = os.path.join(DEF_STATE_DIR, 'ledger.json')
+
+FIRMWARE_KEY = 'file'
+RESUME_KEY = 'resume'
+
+# Serialises read-modify-write of the state files between sessions running
+# in threads of one process; state_lock() adds a lock between processes
+STATE_LOCK = threading.RLock()
+_held = {}
+
+def image_digest(path):
+    '''SHA-256 of an image file, hashed straight from its read-only mapping.'''
+    digest = hashlib.sha256()
+    with open_image(path) as image:
+        image.update(digest)
+    return digest.hexdigest()
+
+def model_key(position, offset):
+    return 'model@0x{0:08X}+0x{1:X}'.format(position, offset)
+
+def load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_json(path, data):
+    '''Write data as JSON through a temp file so a crash never leaves half a file.'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+def _lock_file(f, lock):
+    if (fcntl != None):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if lock else fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if lock else msvcrt.LK_UNLCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after 10 tries a second apart
+            if (not lock):
+                raise
+
+@contextlib.contextmanager
+def state_lock(path):
+    '''
+    Lock a state file for a read-modify-write: STATE_LOCK between threads
+    and an OS lock on path + '.lock' between processes (the ports of a
+    fleet run as children, two fleets on one host).  Reentrant per path.
+    '''
+    with STATE_LOCK:
+        if (path in _held):
+            _held[path] += 1
+            try:
+                yield
+            finally:
+                _held[path] -= 1
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.lock', 'a') as f:
+            _lock_file(f, True)
+            _held[path] = 1
+            try:
+                yield
+            finally:
+                del _held[path]
+                _lock_file(f, False)
+
+class DeployLedger(object):
+    '''
+    Host-side record of what was last sent to each device.
+
+    Entries are keyed by device (serial port or board ID) and then by flash
+    slot: the firmware, or a model at a given position and offset.  Each
+    entry keeps the SHA-256, size and source path of the image that was
+    last transferred successfully.  The ledger only knows about uploads
+    made by this tool.
+    '''
+
+    def __init__(self, path, device):
+        self.path = path
+        self.device = device
+        self.digests = {}
+
+    def _load(self):
+        return load_json(self.path, {})
+
+    def digest(self, path):
+        if (path not in self.digests):
+            self.digests[path] = image_digest(path)
+        return self.digests[path]
+
+    def unchanged(self, key, path):
+        entry = self._load().get(self.device, {}).get(key)
+        return (entry != None) and (entry.get('sha256') == self.digest(path))
+
+    def record(self, key, path, position=0, offset=0):
+        entry = {
+            'sha256': self.digest(path),
+            'size': os.path.getsize(path),
+            'path': os.path.abspath(path),
+            'position': position,
+            'offset': offset,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with state_lock(self.path):
+            ledger = self._load()
+            device = ledger.setdefault(self.device, {})
+            if (device.get(RESUME_KEY, {}).get('key') == key):
+                device.pop(RESUME_KEY)
+            device[key] = entry
+            save_json(self.path, ledger)
+
+    def record_file(self, image_file):
+        self.record(FIRMWARE_KEY, image_file)
+
+    def record_model(self, model):
+        model_file, model_position, model_offset = parse_model_arg(model)
+        self.record(model_key(model_position, model_offset), model_file, model_position, model_offset)
+
+    def checkpoint(self, key, path, packet_size, acked_bytes):
+        '''Remember how far an interrupted model upload got.'''
+        entry = {
+            'key': key,
+            'sha256': self.digest(path),
+            'packet_size': packet_size,
+            'acked_bytes': acked_bytes,
+        }
+        with state_lock(self.path):
+            ledger = self._load()
+            ledger.setdefault(self.device, {})[RESUME_KEY] = entry
+            save_json(self.path, ledger)
+
+    def resume_point(self, key, path, packet_size):
+        '''
+        Bytes of the model already acknowledged by an interrupted upload of
+        the same content with the same packet size, else 0.
+        '''
+        entry = self._load().get(self.device, {}).get(RESUME_KEY)
+        if ((entry == None) or (entry.get('key') != key) or (entry.get('packet_size') != packet_size)):
+            return 0
+        if (entry.get('sha256') != self.digest(path)):
+            return 0
+        return entry.get('acked_bytes', 0)
+
+    def changed(self, image_file, model_list, log=print):
+        '''
+        Drop the images whose content matches the ledger.  Returns the
+        remaining (image_file, model_list), with None for an empty part.
+        '''
+        if ((image_file != None) and self.unchanged(FIRMWARE_KEY, image_file)):
+            log("unchanged, skip >>", image_file)
+            image_file = None
+
+        models = []
+        for model in (model_list or []):
+            model_arg = parse_model_arg(model)
+            if ((model_arg != None) and self.unchanged(model_key(model_arg[1], model_arg[2]), model_arg[0])):
+                log("unchanged, skip >>", model_arg[0])
+                continue
+            models.append(model)
+
+        return image_file, (models or None)
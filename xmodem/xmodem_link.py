@@ -0,0 +1,177 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import serial
+from xmodem_ledger import DEF_STATE_DIR, state_lock, load_json, save_json
+
+DEF_LINK_CACHE = os.path.join(DEF_STATE_DIR, 'link.json')
+
+CANDIDATE_BAUDRATES = [115200, 230400, 460800, 921600]
+
+DEF_PROBE_SIZE = 4096
+DEF_PROBE_TIMEOUT = 1
+# A loopback plug stays silent: anything heard for this long before the
+# probe means a board (a bootloader menu, say) is on the port
+DEF_QUIET_TIME = 0.5
+# Peer name a probe is cached under unless one is given
+DEF_PROBE_PEER = 'loopback'
+# Highest byte error rate still considered stable
+DEF_MAX_ERROR_RATE = 0.001
+
+# Payload size and framing overhead (SOH/STX, seq, ~seq, CRC16) per protocol
+PROTOCOL_BLOCK = {'xmodem': 128, 'xmodem1k': 1024}
+BLOCK_OVERHEAD = 5
+
+def probe_baudrate(port, baudrate, size=DEF_PROBE_SIZE, timeout=DEF_PROBE_TIMEOUT):
+    '''
+    Send a pseudo-random pattern at baudrate and read the echo back.
+
+    Returns the byte error rate (mismatched or missing bytes), the effective
+    bytes/s of the round trip and the turnaround time of a single byte.  The
+    peer must echo what it receives (loopback plug, echo firmware); a silent
+    peer shows up as an error rate of 1.
+    '''
+    pattern = os.urandom(size)
+    ser = serial.Serial(port, baudrate, timeout=timeout)
+
+    try:
+        ser.flushInput()
+
+        start = time.monotonic()
+        ser.write(pattern[:1])
+        ser.read(1)
+        turnaround = time.monotonic() - start
+
+        start = time.monotonic()
+        ser.write(pattern)
+        echo = ser.read(size)
+        elapsed = time.monotonic() - start
+    finally:
+        ser.close()
+
+    errors = size - len(echo) + sum(1 for a, b in zip(pattern, echo) if a != b)
+
+    return {
+        'baudrate': baudrate,
+        'error_rate': errors / size,
+        'bytes_per_s': len(echo) / elapsed if elapsed > 0 else 0,
+        'turnaround': turnaround,
+    }
+
+def port_is_quiet(port, baudrate, wait=DEF_QUIET_TIME):
+    '''True if nothing arrives on port for wait seconds.'''
+    ser = serial.Serial(port, baudrate, timeout=wait)
+    try:
+        ser.flushInput()
+        return (ser.read(1) == b'')
+    finally:
+        ser.close()
+
+def effective_rate(result, protocol):
+    '''
+    Expected payload bytes/s of a stop-and-wait transfer with protocol over a
+    link with the probed rate, turnaround and byte error rate.
+    '''
+    payload = PROTOCOL_BLOCK[protocol]
+    frame = payload + BLOCK_OVERHEAD
+    if (result['bytes_per_s'] <= 0):
+        return 0
+    block_ok = (1 - result['error_rate']) ** frame
+    block_time = frame / result['bytes_per_s'] + result['turnaround']
+    return payload * block_ok / block_time
+
+def choose_link(results, max_error_rate=DEF_MAX_ERROR_RATE):
+    '''Pick the fastest stable (baudrate, protocol), or None.'''
+    best = None
+    for result in results:
+        if (result['error_rate'] > max_error_rate):
+            continue
+        for protocol in PROTOCOL_BLOCK:
+            rate = effective_rate(result, protocol)
+            if (best == None) or (rate > best[2]):
+                best = (result['baudrate'], protocol, rate)
+    return best
+
+def cached_links(cache, port):
+    '''Probed links of port by peer name (entries of old caches were per port only and are ignored).'''
+    links = cache.get(port, {})
+    return {} if ('baudrate' in links) else links
+
+def auto_link(port, peer=None, probe=False, cache_path=DEF_LINK_CACHE, refresh=False, baudrates=CANDIDATE_BAUDRATES, log=print):
+    '''
+    Return the (baudrate, protocol) cached for port and peer, the name of
+    what answered the probe.  Only with probe set (the caller vouches that
+    a loopback plug or echo firmware is on the port, the probe writes
+    random data) are the candidate baud rates probed, refusing a port that
+    talks on its own; the result is cached under peer, DEF_PROBE_PEER by
+    default.  Returns None when there is no cached or stable link.
+    '''
+    if probe and (peer == None):
+        peer = DEF_PROBE_PEER
+    links = cached_links(load_json(cache_path, {}), port)
+
+    if (peer in links) and (not (probe and refresh)):
+        link = links[peer]
+        log("auto-link: cached {0} baud, {1} (probed with {2})".format(link['baudrate'], link['protocol'], peer))
+        return link['baudrate'], link['protocol']
+    if (not probe):
+        log("auto-link: no link probed for {0}{1}; probe a loopback plug or echo firmware with --probe-loopback".format(
+            port, "" if (peer == None) else " with " + peer))
+        return None
+
+    try:
+        quiet = port_is_quiet(port, baudrates[0])
+    except (serial.SerialException, ValueError) as e:
+        log("auto-link: {0} open fail: {1}".format(port, e))
+        return None
+    if (not quiet):
+        log("auto-link: {0} sends data on its own, not a loopback; no probe".format(port))
+        return None
+
+    results = []
+    for baudrate in baudrates:
+        try:
+            result = probe_baudrate(port, baudrate)
+        except (serial.SerialException, ValueError) as e:
+            log("auto-link: {0} baud probe fail: {1}".format(baudrate, e))
+            continue
+        results.append(result)
+        log("auto-link: {0} baud, error rate {1:.4f}, {2:.0f} bytes/s, turnaround {3:.1f} ms".format(
+            baudrate, result['error_rate'], result['bytes_per_s'], result['turnaround'] * 1000))
+
+    best = choose_link(results)
+    if (best == None):
+        log("auto-link: no stable link found")
+        return None
+
+    baudrate, protocol, rate = best
+    log("auto-link: best {0} baud, {1} (about {2:.0f} bytes/s)".format(baudrate, protocol, rate))
+    with state_lock(cache_path):
+        cache = load_json(cache_path, {})
+        links = cached_links(cache, port)
+        links[peer] = {'baudrate': baudrate, 'protocol': protocol, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+        cache[port] = links
+        save_json(cache_path, cache)
+
+    return baudrate, protocol
@@ -0,0 +1,292 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import sys
+import json
+import time
+import threading
+import collections
+import http.server
+from xmodem_telemetry import percentile
+
+DEF_WINDOW = 60.0
+DEF_INTERVAL = 10.0
+# WE2 Cortex-M55 clock the "Tick for ..." counters run at
+DEF_CPU_MHZ = 400
+
+METRIC_PREFIX = 'himax_'
+
+# Frame group of the builtin rules: an app prints several of their lines
+# per frame (tflm_fd_fm the detection result and Tick for TOTAL, the Edge
+# Impulse firmware Timing: and Predictions), only one may count frames
+APP_FRAME = 'app'
+
+class Rule(object):
+    '''
+    One line parser: a regex whose named groups are numeric samples.
+
+    :param name: Rule name, reported with its samples.
+    :param pattern: Regex searched in every line.  Each named group that
+        parses as a number becomes a sample of the metric with that name.
+    :param frame: True if a match marks one processed frame (for FPS), or
+        the name of a frame group: of the rules in one group only the
+        first one seen on a source counts frames there.
+    :param scale: Optional {group: factor} applied to the samples.
+    '''
+
+    def __init__(self, name, pattern, frame=False, scale=None):
+        self.name = name
+        self.regex = re.compile(pattern)
+        self.frame = frame
+        self.scale = scale or {}
+
+    def frame_group(self):
+        '''Frame group name, None if the rule does not mark frames.'''
+        if (self.frame == True):
+            return self.name
+        return self.frame or None
+
+    def match(self, line):
+        '''Returns {metric: value} for a matching line, else None.'''
+        m = self.regex.search(line)
+        if (m == None):
+            return None
+        samples = {}
+        for key, value in m.groupdict().items():
+            try:
+                samples[key] = float(value) * self.scale.get(key, 1)
+            except (TypeError, ValueError):
+                pass
+        return samples
+
+def builtin_rules(cpu_mhz=DEF_CPU_MHZ):
+    '''Rules for the timing and result lines the scenario apps print.'''
+    tick_ms = 1.0 / (cpu_mhz * 1000)
+    return [
+        # edge_impulse_firmware: ei_device_lib.cpp
+        Rule('ei_timing', r'Timing: DSP (?P<dsp_ms>[\d.]+) ms, inference (?P<inference_ms>[\d.]+) ms, anomaly (?P<anomaly_ms>[\d.]+) ms',
+             frame=APP_FRAME),
+        # ei_standalone_inferencing*: display_results()
+        Rule('ei_predictions', r'Predictions \(DSP: (?P<dsp_ms>\d+) ms\., Classification: (?P<inference_ms>\d+) ms\., Anomaly: (?P<anomaly_ms>\d+) ms\.\)',
+             frame=APP_FRAME),
+        # tflm_fd_fm
+        Rule('fd_fm', r'detection result: tracked_face_targets\[(?P<detections>\d+)\]', frame=APP_FRAME),
+        # tflm_yolov8_od, tflm_yolov8_pose, tflm_peoplenet, tflm_fd_fm: TOTAL_STEP_TICK_DBG_LOG
+        Rule('total_tick', r'Tick for TOTAL[^:]*:\s*\[(?P<total_ms>\d+)\]', frame=APP_FRAME, scale={'total_ms': tick_ms}),
+        # step ticks (invoke, post processing) of the same apps
+        Rule('invoke_tick', r'Tick for [Ii]nvoke (?:for|of) (?!uint8toint8)[^:]*?(?<!post_processing):\s*\[(?P<invoke_ms>\d+)\]', scale={'invoke_ms': tick_ms}),
+        # tflm_yolov8_od: one line per detected object
+        Rule('detect_object', r'detect object\[\d+\]: .* confidences: (?P<confidence>[\d.]+)'),
+        # allon_sensor_tflm*
+        Rule('person_score', r'person_score:(?P<person_score>-?\d+)', frame=APP_FRAME),
+    ]
+
+def load_rules(path):
+    '''
+    User rules from a JSON file: a list of {"name", "pattern", "frame",
+    "scale"} objects, "frame" and "scale" optional.
+    '''
+    with open(path) as f:
+        return [Rule(r['name'], r['pattern'], r.get('frame', False), r.get('scale')) for r in json.load(f)]
+
+def parse_rule_arg(arg):
+    '''A --rule "NAME=REGEX" argument.'''
+    name, sep, pattern = arg.partition('=')
+    if (sep == '') or (name == ''):
+        raise ValueError("--rule expects NAME=REGEX: " + arg)
+    return Rule(name, pattern)
+
+def metric_name(name):
+    return METRIC_PREFIX + re.sub(r'[^A-Za-z0-9_]', '_', name)
+
+class LineMetrics(object):
+    '''
+    Rolling statistics over the last ``window`` seconds of device output.
+
+    ``feed()`` runs every rule on a line; samples are kept per (source,
+    metric) with their arrival time, frames per source (one rule per
+    frame group and source counts them).  ``snapshot()``
+    gives FPS and count/sum/mean/p50/p99/min/max per metric over the
+    window plus totals since start.  Safe to feed and read from different
+    threads.
+    '''
+
+    def __init__(self, rules, window=DEF_WINDOW):
+        self.rules = rules
+        self.window = window
+        self.samples = collections.defaultdict(collections.deque)
+        self.totals = collections.Counter()
+        self.frames = collections.defaultdict(collections.deque)
+        self.frame_totals = collections.Counter()
+        self.frame_rules = {}
+        self.matches = collections.Counter()
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def feed(self, line, source='', ts=None):
+        if (ts == None):
+            ts = time.time()
+        for rule in self.rules:
+            samples = rule.match(line)
+            if (samples == None):
+                continue
+            with self.lock:
+                self.matches[rule.name] += 1
+                group = rule.frame_group()
+                if (group != None) and (self.frame_rules.setdefault((source, group), rule.name) == rule.name):
+                    self.frames[source].append(ts)
+                    self.frame_totals[source] += 1
+                for name, value in samples.items():
+                    self.samples[(source, name)].append((ts, value))
+                    self.totals[(source, name)] += 1
+
+    def _expire(self, now):
+        limit = now - self.window
+        for series in self.samples.values():
+            while series and (series[0][0] < limit):
+                series.popleft()
+        for frames in self.frames.values():
+            while frames and (frames[0] < limit):
+                frames.popleft()
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            span = min(self.window, now - self.start)
+            sources = {}
+            for source, frames in self.frames.items():
+                entry = sources.setdefault(source, {'metrics': {}})
+                entry['fps'] = round(len(frames) / span, 3) if (span > 0) else 0.0
+                entry['frames'] = self.frame_totals[source]
+            for (source, name), series in self.samples.items():
+                values = sorted(value for _, value in series)
+                stats = {'total': self.totals[(source, name)], 'count': len(values)}
+                if (len(values) > 0):
+                    stats.update({
+                        'sum': round(sum(values), 3),
+                        'mean': round(sum(values) / len(values), 3),
+                        'min': values[0],
+                        'p50': percentile(values, 50),
+                        'p99': percentile(values, 99),
+                        'max': values[-1],
+                        'last': series[-1][1],
+                    })
+                sources.setdefault(source, {'metrics': {}})['metrics'][name] = stats
+            return {'time': round(now, 3), 'window_s': self.window,
+                    'matches': dict(self.matches), 'sources': sources}
+
+    def prometheus(self):
+        '''The snapshot in Prometheus text exposition format.'''
+        snap = self.snapshot()
+        lines = []
+
+        def labels(source, **extra):
+            pairs = ([('source', source)] if source else []) + sorted(extra.items())
+            if (len(pairs) == 0):
+                return ''
+            return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+        lines.append('# TYPE {0} gauge'.format(metric_name('fps')))
+        for source, entry in snap['sources'].items():
+            if ('fps' in entry):
+                lines.append('{0}{1} {2}'.format(metric_name('fps'), labels(source), entry['fps']))
+        lines.append('# TYPE {0} counter'.format(metric_name('frames_total')))
+        for source, entry in snap['sources'].items():
+            if ('frames' in entry):
+                lines.append('{0}{1} {2}'.format(metric_name('frames_total'), labels(source), entry['frames']))
+        names = sorted({name for entry in snap['sources'].values() for name in entry['metrics']})
+        for name in names:
+            metric = metric_name(name)
+            lines.append('# TYPE {0} summary'.format(metric))
+            for source, entry in snap['sources'].items():
+                stats = entry['metrics'].get(name)
+                if (stats == None):
+                    continue
+                if ('p50' in stats):
+                    lines.append('{0}{1} {2}'.format(metric, labels(source, quantile='0.5'), stats['p50']))
+                    lines.append('{0}{1} {2}'.format(metric, labels(source, quantile='0.99'), stats['p99']))
+                lines.append('{0}_sum{1} {2}'.format(metric, labels(source), stats.get('sum', 0)))
+                lines.append('{0}_count{1} {2}'.format(metric, labels(source), stats['count']))
+        return '\n'.join(lines) + '\n'
+
+class MetricsReporter(object):
+    '''
+    Publishes a LineMetrics: a JSON line every ``interval`` seconds to
+    ``json_path`` ('-' for stdout), and/or a Prometheus text endpoint on
+    http://<bind>:<port>/metrics.
+    '''
+
+    def __init__(self, metrics, json_path=None, interval=DEF_INTERVAL, port=None, bind='127.0.0.1'):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.interval = interval
+        self.server = None
+        self._stop = threading.Event()
+
+        if (port != None):
+            metrics_ref = metrics
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if (self.path.split('?')[0] not in ('/', '/metrics')):
+                        self.send_error(404)
+                        return
+                    body = metrics_ref.prometheus().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = http.server.ThreadingHTTPServer((bind, port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print("Metrics at http://{0}:{1}/metrics".format(bind, self.server.server_address[1]))
+
+        if (json_path != None):
+            threading.Thread(target=self._json_loop, daemon=True).start()
+
+    def _json_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write_json()
+
+    def write_json(self):
+        line = json.dumps(self.metrics.snapshot())
+        if (self.json_path == '-'):
+            print(line)
+            sys.stdout.flush()
+        else:
+            with open(self.json_path, 'a') as f:
+                f.write(line + '\n')
+
+    def close(self):
+        self._stop.set()
+        if (self.json_path != None):
+            self.write_json()
+        if (self.server != None):
+            self.server.shutdown()
+            self.server.server_close()
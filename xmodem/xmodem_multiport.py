@@ -0,0 +1,187 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import time
+import serial
+import selectors
+from xmodem_fleet import expand_ports, port_log_name
+
+DEF_RESCAN = 2.0
+POLL_INTERVAL = 0.02
+READ_SIZE = 65536
+# longer output without a line break is logged in pieces of this size
+MAX_LINE = 4096
+
+def format_ts(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)) + '.{0:03d}'.format(int(ts * 1000) % 1000)
+
+class PortStream(object):
+    '''One watched port: the open serial object, its partial line and log file.'''
+
+    def __init__(self, port, ser, log):
+        self.port = port
+        self.name = os.path.basename(port)
+        self.ser = ser
+        self.log = log
+        self.partial = b''
+        self.lines = 0
+        self.bytes = 0
+
+class MultiPortLogger(object):
+    '''
+    Line logger for many serial ports in one thread.
+
+    Every port is registered with a selector, so an idle port costs
+    nothing and a busy one costs one read per wakeup.  Complete lines are
+    tagged with a timestamp and the port name and written, in the order
+    they were read, to the merged output and to ``<log_dir>/<port>.log``.
+    The port list (comma separated, globs allowed) is expanded again every
+    ``rescan`` seconds: new ports are opened, ports that vanish or fail are
+    closed and picked up again when they come back.  Where the platform
+    cannot select on serial handles (Windows), the ports are polled.
+    ``on_line(text, port_name, ts)`` is called for every line.
+    '''
+
+    def __init__(self, port_spec, baudrate, merged=sys.stdout, log_dir=None, rescan=DEF_RESCAN, on_line=None):
+        self.port_spec = port_spec
+        self.on_line = on_line
+        self.baudrate = baudrate
+        self.merged = merged
+        self.log_dir = log_dir
+        self.rescan = rescan
+        self.selector = selectors.DefaultSelector()
+        self.streams = {}
+        self.polled = []
+        self._next_scan = 0
+
+        if (log_dir != None):
+            os.makedirs(log_dir, exist_ok=True)
+
+    def _event(self, port, text):
+        self.merged.write("{0} [{1}] *** {2}\n".format(format_ts(time.time()), os.path.basename(port), text))
+        self.merged.flush()
+
+    def scan(self):
+        '''Open ports that appeared since the last scan.'''
+        for port in expand_ports(self.port_spec):
+            if (port in self.streams):
+                continue
+            try:
+                ser = serial.Serial(port, self.baudrate, timeout=0)
+            except (serial.SerialException, OSError, ValueError):
+                continue
+            log = None
+            if (self.log_dir != None):
+                log = open(os.path.join(self.log_dir, port_log_name(port)), 'a')
+            stream = PortStream(port, ser, log)
+            self.streams[port] = stream
+            try:
+                self.selector.register(ser.fileno(), selectors.EVENT_READ, stream)
+            except (AttributeError, ValueError, OSError):
+                self.polled.append(stream)
+            self._event(port, "connected")
+
+    def drop(self, stream, reason):
+        self._flush_partial(stream, time.time())
+        if (stream in self.polled):
+            self.polled.remove(stream)
+        else:
+            try:
+                self.selector.unregister(stream.ser.fileno())
+            except (KeyError, ValueError, OSError):
+                pass
+        try:
+            stream.ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        if (stream.log != None):
+            stream.log.close()
+        del self.streams[stream.port]
+        self._event(stream.port, reason)
+
+    def _emit(self, stream, line, ts):
+        text = line.rstrip(b'\r').decode('utf-8', errors='backslashreplace')
+        stamp = format_ts(ts)
+        self.merged.write("{0} [{1}] {2}\n".format(stamp, stream.name, text))
+        if (stream.log != None):
+            stream.log.write("{0} {1}\n".format(stamp, text))
+        stream.lines += 1
+        if (self.on_line != None):
+            self.on_line(text, stream.name, ts)
+
+    def _flush_partial(self, stream, ts):
+        if (stream.partial != b''):
+            self._emit(stream, stream.partial, ts)
+            stream.partial = b''
+
+    def service(self, stream):
+        '''Read what the port has and emit its complete lines.'''
+        try:
+            data = stream.ser.read(stream.ser.in_waiting or READ_SIZE)
+        except (serial.SerialException, OSError) as e:
+            self.drop(stream, "disconnected ({0})".format(e))
+            return
+        if not data:
+            return
+        ts = time.time()
+        stream.bytes += len(data)
+        lines = (stream.partial + data).split(b'\n')
+        stream.partial = lines.pop()
+        for line in lines:
+            self._emit(stream, line, ts)
+        while (len(stream.partial) > MAX_LINE):
+            self._emit(stream, stream.partial[:MAX_LINE], ts)
+            stream.partial = stream.partial[MAX_LINE:]
+
+    def run_once(self, timeout):
+        now = time.monotonic()
+        if (now >= self._next_scan):
+            self.scan()
+            self._next_scan = now + self.rescan
+        if (len(self.polled) > 0):
+            timeout = min(timeout, POLL_INTERVAL)
+        if (len(self.selector.get_map() or {}) > 0):
+            events = self.selector.select(timeout)
+        else:
+            time.sleep(timeout)
+            events = []
+        for key, mask in events:
+            self.service(key.data)
+        for stream in list(self.polled):
+            # service() drops a port that fails (unplugged) instead of raising
+            self.service(stream)
+        self.merged.flush()
+
+    def run(self):
+        try:
+            while True:
+                self.run_once(min(self.rescan, 1.0))
+        except KeyboardInterrupt:
+            pass
+        self.close()
+
+    def close(self):
+        for stream in list(self.streams.values()):
+            self.drop(stream, "closed, {0} lines, {1} bytes".format(stream.lines, stream.bytes))
+        self.selector.close()
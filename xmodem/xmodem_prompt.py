@@ -0,0 +1,178 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import time
+from xmodem_buffer import BufferedReader
+
+# Bootloader prompts
+PROMPT_XMODEM = re.compile(rb'Send data using the xmodem protocol')
+PROMPT_END = re.compile(rb'Do you want to end file transmission')
+
+# Receiver start characters: NAK, 'C' (crc16) and 'G' (streaming), as the
+# last byte seen, following a line break or another start character and
+# followed by a read that timed out (DEF_POLL seconds without console
+# output).  A read can end in the middle of a console line ("...SUCC",
+# "\nCopy..."), the rest of that line arrives well within the poll time.
+START_CHARS = b'\x15CG'
+START_AFTER = b'\r\n\x15CG'
+XMODEM_START = re.compile(rb'[\r\n\x15CG]([\x15CG])$')
+
+DEF_POLL = 0.05
+
+STATE_BOOT = 'boot'
+STATE_START = 'start'
+STATE_END = 'end'
+
+class BootloaderSync(object):
+    '''
+    Prompt-matching state machine for the bootloader console.
+
+    Incoming bytes are consumed incrementally (whatever the port has ready,
+    at most ``poll`` seconds per read) and matched against precompiled
+    patterns, so each state finishes as soon as its prompt arrives instead
+    of after fixed sleeps.  Every state has its own deadline; the time spent
+    in each one is kept in ``timings`` as ``(state, seconds)``.
+
+    Bytes read past a match stay buffered and are served first by
+    ``read()``, which is what the xmodem getc should call.  A start
+    character only counts once a read after it timed out (the console
+    stayed quiet for ``poll`` seconds).  All port reads
+    go through ``reader`` (a BufferedReader), so bytes it read ahead during
+    a transfer are seen by the next prompt match.
+    '''
+
+    def __init__(self, ser, poll=DEF_POLL, echo=True, reader=None, log=print):
+        self.ser = ser
+        self.poll = poll
+        self.echo = echo
+        self.log = log
+        self.reader = reader if (reader != None) else BufferedReader(ser, log=log)
+        self.buf = bytearray()
+        self.line_start = True
+        self.idle = False
+        self.timings = []
+
+    def read(self, size, timeout=None):
+        if (len(self.buf) == 0):
+            return self.reader.read(size, timeout)
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        if (len(data) < size):
+            data += self.reader.read(size - len(data), timeout) or b''
+        return data
+
+    def flush(self):
+        self.buf.clear()
+        self.reader.flush()
+
+    def send(self, command):
+        self.ser.write(bytes(command+"\r", encoding='ascii'))
+
+    def _fill(self):
+        data = self.reader.read_some(self.poll)
+        self.idle = (len(data) == 0)
+        self.buf += data
+        return len(data)
+
+    def _wait(self, state, deadline, match):
+        '''
+        Feed bytes to match(buf) until it returns True or the deadline
+        (seconds, None for no limit) passes.
+        '''
+        start = time.monotonic()
+        end = None if (deadline == None) else start + deadline
+
+        while (not match()):
+            if ((end != None) and (time.monotonic() >= end)):
+                self.log("sync: {0} timeout after {1:.3f}s".format(state, time.monotonic() - start))
+                return False
+            self._fill()
+
+        self.timings.append((state, time.monotonic() - start))
+        return True
+
+    def _match_lines(self, pattern, reply=None):
+        '''Match pattern line by line, answering reply after every line.'''
+        def match():
+            while True:
+                line_end = self.buf.find(b'\n')
+                if (line_end < 0):
+                    return pattern.search(self.buf) != None
+                line = bytes(self.buf[:line_end + 1])
+                del self.buf[:line_end + 1]
+                if self.echo:
+                    self.log(str(line.strip()))
+                if (reply != None):
+                    self.send(reply)
+                if (pattern.search(line) != None):
+                    return True
+        return match
+
+    def _match_start(self):
+        '''
+        Drop console text until the receiver's start character shows up
+        and the next read times out.  line_start
+        remembers whether the byte before the buffer (dropped already) was
+        a line break or start character.
+        '''
+        self.line_start = True
+        self.idle = False
+        def match():
+            found = XMODEM_START.search(self.buf)
+            if (found != None):
+                del self.buf[:found.start(1)]
+                self.line_start = True
+            if (len(self.buf) == 1) and self.line_start and (self.buf[0] in START_CHARS):
+                # keep the candidate until a read comes back empty
+                return self.idle
+            if (len(self.buf) > 0):
+                self.line_start = (self.buf[-1] in START_AFTER)
+                self.buf.clear()
+            return False
+        return match
+
+    def enter_xmodem(self, deadline=None):
+        '''
+        Wait for the xmodem prompt (answering '1' to every console line, as
+        the reset menu expects), select xmodem and wait for the receiver.
+        '''
+        if (not self._wait(STATE_BOOT, deadline, self._match_lines(PROMPT_XMODEM, reply='1'))):
+            return False
+        self.buf.clear()
+        self.send('1')
+        return self._wait(STATE_START, deadline, self._match_start())
+
+    def next_session(self, deadline=None):
+        '''
+        After a transfer, wait for the end-of-transmission question, answer
+        'n' and wait for the receiver to start the next session.
+        '''
+        if (not self._wait(STATE_END, deadline, self._match_lines(PROMPT_END))):
+            return False
+        self.buf.clear()
+        self.send('n')
+        return self._wait(STATE_START, deadline, self._match_start())
+
+    def report(self):
+        for state, seconds in self.timings:
+            self.log("sync: {0} {1:.3f}s".format(state, seconds))
@@ -22,101 +22,11 @@
 
 #!/usr/bin/env python
 import serial
-import xmodem
-import time
-import os
 import sys
-import logging
 import argparse
-
-#logging.basicConfig(level=logging.DEBUG)
-
-DEF_TIMEOUT = 60
-DEF_BAUDRATE = 115200
-DEF_PROTOCOL = 'xmodem'
-DEF_CHECK = 'crc16'
-
-PROTOCOL = [DEF_PROTOCOL, 'xmodem1k']
-CHECK = [DEF_CHECK, 'sum8']
-
-xmodemRecType = {b'\x06' : 'ACK', b'\x15' : 'NAK'}
-xmodemSndType = {0x01 : 'SOH', 0x02 : 'STX', 0x04 : 'EOT', 0x10 : 'DLE', 0xC : 'CRC', 0x18 : 'CAN'}
-
-def callback(total_packets, success_count, error_count, packet_size):
-    print('packets {0} '.format(total_packets) + ' success {0}'.format(success_count) + ' error {0}'.format(error_count) + ' packet_size {0}'.format(packet_size))
-
-def uart_open(ser, com, baudrate, timeout):
-    ser.port = com
-    ser.timeout = timeout
-    ser.baudrate = baudrate
-    ser.bytesize = serial.EIGHTBITS
-    ser.stopbits = serial.STOPBITS_ONE
-    ser.xonxoff = 0
-    ser.rtscts = 0
-    ser.parity = serial.PARITY_NONE
-    ser.open()
-    print("Open Serial Port", ser.port)
-
-def dev_init():
-    global ser
-    ser = serial.Serial()
-
-    try:
-        uart_open(ser=ser, com=args.port, baudrate=args.baudrate, timeout=args.timeout)
-        ser.flushInput()
-        ser.flushOutput()
-    except:
-        print("Uart port open fail")
-        sys.exit(-1)
-
-def send_at_command(command):
-    ser.write(bytes(command+"\r", encoding='ascii'))
-
-def getc_user(size, timeout=1):
-    return ser.read(size)
-
-    #gbytes = ser.read(size)
-    #if gbytes in xmodemRecType:
-    #    rec = xmodemRecType[gbytes]
-    #else:
-    #    rec = gbytes
-    #print(f'->R: {rec}')
-    #return gbytes or None
-
-def putc_user(data, timeout=1):
-    return ser.write(data)
-
-    #pbytes = ser.write(data)
-    #if data[0] in xmodemSndType:
-    #    header = xmodemSndType[data[0]]
-    #else:
-    #    header = data[0]
-    #if len(data) >= 4:
-    #    print(f'<-S: {header} | {data[1]}~{data[2]} | {data[3:-2]} | {data[-2]} {data[-1]}')
-    #else:
-    #    print(f'<-S: {data} - {header}')
-    #return pbytes or None
-
-def xmodem_recv_bin():
-    modem = xmodem.XMODEM(getc=getc_user, putc=putc_user)
-    print("xmodem_receiving ... ", args.file)
-    stream = open(args.file, 'wb')
-
-    _crc_mode = 1
-
-    if (args.check != DEF_CHECK) :
-        _crc_mode = 0
-
-    ret = modem.recv(stream, crc_mode=_crc_mode, callback=callback)
-    stream.close()
-
-    if (ret) :
-        print("xmodem_recv bin file done!!")
-    else :
-        print("xmodem_recv bin file FAIL!!!!")
-        return ret
-
-    return ret
+from xmodem_link import DEF_LINK_CACHE, DEF_PROBE_PEER
+from xmodem_trace import DEF_SPEED
+from xmodem_session import RecvSession, DEF_TIMEOUT, DEF_BAUDRATE, DEF_CHECK, CHECK
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -125,7 +35,16 @@ if __name__ == '__main__':
                         help="Serial device port: COMn for windows; /dev/ttyUSBn,/dev/ttySn for unix; /dev/tty.usbserial-abcde for MacOS")
     parser.add_argument("--file",
                         required=True, type=str,
-                        help="File path for saving bin file")
+                        help="File path for saving bin file, '-' for stdout; a FIFO is written block by block")
+    parser.add_argument("--size",
+                        default=None, type=lambda x: int(x,0),
+                        help="Expected size in bytes: the output is preallocated and the xmodem padding is stripped")
+    parser.add_argument("--sha256",
+                        default=None, type=str,
+                        help="Expected SHA-256 (hex) of the received data")
+    parser.add_argument("--crc32",
+                        default=None, type=lambda x: int(x,0),
+                        help="Expected CRC32 of the received data")
     parser.add_argument("--baudrate",
                         default=DEF_BAUDRATE, type=lambda x: int(x,0),
                         help="Serial device baudrate. Default is " + str(DEF_BAUDRATE))
@@ -133,18 +52,66 @@ if __name__ == '__main__':
                         default=DEF_CHECK, type=str,
                         choices=CHECK, 
                         help="xmodem crc_mode. Default is " + DEF_CHECK)
+    parser.add_argument("--low-latency", action='store_true',
+                        help="Ask the serial driver for low latency mode (no receive batching) where supported")
+    parser.add_argument("--auto-link", action='store_true',
+                        help="Report the fastest stable baud rate probed on --port (cached per port and peer). "
+                             "Diagnostic only, --baudrate is used as given")
+    parser.add_argument("--relink", action='store_true',
+                        help="With --probe-loopback, probe again instead of using the cached result")
+    parser.add_argument("--probe-loopback", action='store_true',
+                        help="With --auto-link, probe --port by writing random data at every candidate baud rate. "
+                             "Only for a loopback plug or echo firmware, never a board in its bootloader")
+    parser.add_argument("--link-peer", type=str,
+                        help="With --auto-link, report (or with --probe-loopback, cache) the link probed on --port with this peer. "
+                             "Default is " + DEF_PROBE_PEER + " when probing, else no cached link is used")
+    parser.add_argument("--link-cache",
+                        default=DEF_LINK_CACHE, type=str,
+                        help="Link probe cache file. Default is " + DEF_LINK_CACHE)
     parser.add_argument("--timeout",
                         default=DEF_TIMEOUT, type=lambda x: int(x,0),
                         help="Serial device timeout. Default is " + str(DEF_TIMEOUT))
+    parser.add_argument("--report", type=str,
+                        help="Write per-block transfer telemetry to this file (JSON, or JSONL for a .jsonl name)")
+    parser.add_argument("--record", type=str,
+                        help="Log every byte read and written with timestamps to this trace file (gzip compressed for a .gz name)")
+    parser.add_argument("--replay", type=str,
+                        help="Run against a trace written by --record instead of the serial port")
+    parser.add_argument("--replay-speed",
+                        default=DEF_SPEED, type=float,
+                        help="Replay timing: 1 as recorded, 2 twice as fast, 0 as fast as possible. Default is " + str(DEF_SPEED))
+    parser.add_argument("--exit", action='store_true',
+                        help="Exit after the transfer instead of showing the device messages")
     args = parser.parse_args()
 
-    dev_init()
+    if (args.file == '-'):
+        # stdout carries the data, messages go to stderr
+        sys.stdout = sys.stderr
+
+    session = RecvSession(args.port, args.file, size=args.size, sha256=args.sha256, crc32=args.crc32,
+                          check=args.check, baudrate=args.baudrate, timeout=args.timeout,
+                          low_latency=args.low_latency, auto_link=args.auto_link, relink=args.relink,
+                          link_cache=args.link_cache, link_peer=args.link_peer, probe_loopback=args.probe_loopback,
+                          report=args.report, record=args.record,
+                          replay=args.replay, replay_speed=args.replay_speed)
+
+    try:
+        session.open()
+    except (serial.SerialException, OSError, ValueError):
+        print("Uart port open fail")
+        sys.exit(-1)
     print('Device init successfully')
 
-    ret = xmodem_recv_bin()
+    ret = session.transfer()
     print("xmodem_recv bin file result = ",ret)
 
+    session.write_report()
+
+    if (args.exit):
+        session.close()
+        sys.exit(0 if ret else 1)
+
     # show message after recv 
     while(True):
-        response = ser.readline().strip()
+        response = session.ser.readline().strip()
         print(str(response))
@@ -22,229 +22,36 @@
 
 #!/usr/bin/env python
 import serial
-import xmodem
-import time
-import os
 import sys
-import logging
 import argparse
-import math
-
-#logging.basicConfig(level=logging.DEBUG)
-
-DEF_TIMEOUT = 60
-DEF_BAUDRATE = 115200
-DEF_PROTOCOL = 'xmodem'
-DEF_CHECK = 'crc16'
-
-PROTOCOL = [DEF_PROTOCOL, 'xmodem1k']
-CHECK = [DEF_CHECK, 'sum8']
-
-xmodemRecType = {b'\x06' : 'ACK', b'\x15' : 'NAK'}
-xmodemSndType = {0x01 : 'SOH', 0x02 : 'STX', 0x04 : 'EOT', 0x10 : 'DLE', 0xC : 'CRC', 0x18 : 'CAN'}
-send_bin_total_packtets = 0
-
-def callback(total_packets, success_count, error_count):
-    #print('packets {0} '.format(total_packets) + ' success {0}'.format(success_count) + ' error {0}'.format(error_count))
-
-    if (send_bin_total_packtets != 0):
-        bar_total = 30
-        bar_string_fmt = "\r[{}{}] {:.2%} {}/{} error: {}"
-        bar_cnt = (int((total_packets/send_bin_total_packtets)*bar_total))
-        space_cnt = bar_total - bar_cnt
-
-        progress = bar_string_fmt.format(
-            "█" * bar_cnt,
-            " " * space_cnt,
-            total_packets/send_bin_total_packtets,
-            total_packets,
-            send_bin_total_packtets,
-            error_count
-        )
-
-        print(progress, end="")
-        percent = total_packets/send_bin_total_packtets
-        
-        if percent >= 1:
-            print("\n")
-
-def uart_open(ser, com, baudrate, timeout):
-    ser.port = com
-    ser.timeout = timeout
-    ser.baudrate = baudrate
-    ser.bytesize = serial.EIGHTBITS
-    ser.stopbits = serial.STOPBITS_ONE
-    ser.xonxoff = 0
-    ser.rtscts = 0
-    ser.parity = serial.PARITY_NONE
-    ser.open()
-    print("Open Serial Port", ser.port)
-
-def dev_init():
-    global ser
-    ser = serial.Serial()
-
-    try:
-        uart_open(ser=ser, com=args.port, baudrate=args.baudrate, timeout=args.timeout)
-        ser.flushInput()
-        ser.flushOutput()
-    except:
-        print("Uart port open fail")
-        sys.exit(-1)
-
-def send_at_command(command):
-    ser.write(bytes(command+"\r", encoding='ascii'))
-
-def getc_user(size, timeout=1):
-    return ser.read(size)
-
-    #gbytes = ser.read(size)
-    #if gbytes in xmodemRecType:
-    #    rec = xmodemRecType[gbytes]
-    #else:
-    #    rec = gbytes
-    #print(f'->R: {rec}')
-    #return gbytes or None
-
-def putc_user(data, timeout=1):
-    return ser.write(data)
-
-    #pbytes = ser.write(data)
-    #if data[0] in xmodemSndType:
-    #    header = xmodemSndType[data[0]]
-    #else:
-    #    header = data[0]
-    #if len(data) >= 4:
-    #    print(f'<-S: {header} | {data[1]}~{data[2]} | {data[3:-2]} | {data[-2]} {data[-1]}')
-    #else:
-    #    print(f'<-S: {data} - {header}')
-    #return pbytes or None
-
-def xmodem_send_bin():
-    global send_bin_total_packtets
-    model_list = args.model
-    image_file = args.file
-
-    if ((image_file == None) and (model_list == None)):
-        print("--file and --model error parameter")
-        return False
-
-    print("Please press reset button!!")
-
-    while(True):
-        response = ser.readline().strip()
-        print(str(response))
-        send_at_command('1')
-
-        if (str(response).count('Send data using the xmodem protocol from your terminal') > 0) :
-            break
-
-    time.sleep(1)
-    ser.flushInput()
-    send_at_command('1')
-
-    ret = False
-    _wait_reboot_system = False
-    packtet_size = 1024
-
-    if (args.protocol == DEF_PROTOCOL):
-        packtet_size = 128
-
-    modem = xmodem.XMODEM(getc=getc_user, putc=putc_user, mode=args.protocol)
-
-    if (image_file != None):
-        print("xmodem_sending >>", image_file)
-        send_bin_total_packtets = math.ceil(os.path.getsize(image_file) / packtet_size)
-        stream = open(image_file, 'rb')
-        ret = modem.send(stream, callback=callback)
-        stream.close()
-        
-        if (ret) :
-            print("xmodem_send bin file done!!")
-            _wait_reboot_system = True
-        else :
-            print("xmodem_send bin file FAIL!!!!")
-            return ret
-
-    if model_list == None:
-        return ret
-
-    idx = 0
-
-    while (idx < len(model_list)):
-        model_arg = model_list[idx].split(" ")
-        
-        if (len(model_arg) < 2) :
-            print("--model error parameter")
-            return False
-
-        while(_wait_reboot_system):
-            response = ser.readline().strip()        
-            if (str(response).count('Do you want to end file transmission and reboot system? (y)') > 0) :
-                break
-
-        time.sleep(1)
-        ser.flushInput()
-        send_at_command('n')
-
-        model_file = model_list[idx].split(" ")[0]
-        model_file_dir = os.path.dirname(os.path.realpath(model_file))
-        preamble_data = '_temp_model_' + str(idx) + '_preamble_data.bin'
-        preamble_data_filepath = os.path.join(model_file_dir, preamble_data)
-        print("generate {0} for {1} preamble data".format(preamble_data, model_file))
-
-        model_position = int(model_list[idx].split(" ")[1], 16)
-        model_offset = 0
-        if (len(model_arg) > 2) :
-            model_offset = int(model_list[idx].split(" ")[2], 16)
-            
-        header = [0xC0, 0x5A] + list(model_position.to_bytes(4, 'little')) + list(model_offset.to_bytes(4, 'little')) + [0x5A, 0xC0] + [0xFF] * (packtet_size - 12)
-        idx = idx + 1
-
-        wb = open(preamble_data_filepath, 'wb')
-        wb.write(bytearray(header))
-        wb.close()
-
-        print("xmodem_sending >>", preamble_data)
-        send_bin_total_packtets = math.ceil(os.path.getsize(preamble_data_filepath) / packtet_size)
-        stream = open(preamble_data_filepath, 'rb')
-        ret = modem.send(stream, callback=callback)
-        stream.close()
-
-        if (ret) :
-            print("xmodem_send bin file done!!")
-        else :
-            print("xmodem_send bin file FAIL!!!!")
-            return ret
-
-        while(True):
-            response = ser.readline().strip()        
-            if (str(response).count('Do you want to end file transmission and reboot system? (y)') > 0) :
-                break
-
-        time.sleep(1)
-        ser.flushInput()
-        send_at_command('n')
-
-        print("xmodem_sending >>", model_file)
-
-        stream = open(model_file, 'rb')
-        send_bin_total_packtets = math.ceil(os.path.getsize(model_file) / packtet_size)
-        ret = modem.send(stream, callback=callback)
-        stream.close()
-
-        if (ret) :
-            print("xmodem_send bin file done!!")
-        else :
-            print("xmodem_send bin file FAIL!!!!")
-            return ret
-    return ret
+from xmodem_ext import DEF_WINDOW
+from xmodem_ledger import DEF_LEDGER
+from xmodem_fleet import is_fleet, expand_ports, run_fleet, port_file_name, DEF_JOBS
+from xmodem_link import DEF_LINK_CACHE, DEF_PROBE_PEER
+from xmodem_trace import DEF_SPEED
+from xmodem_session import SendSession, DEF_TIMEOUT, DEF_BAUDRATE, DEF_PROTOCOL, PROTOCOL
+
+def make_session(port, board_id=None, log=print):
+    report, record, replay = args.report, args.record, args.replay
+    # every board of a fleet has its own report and trace file
+    if is_fleet(args.port):
+        report, record, replay = [port_file_name(path, port) if (path != None) else None
+                                  for path in (report, record, replay)]
+    return SendSession(port, image_file=args.file, model_list=args.model, baudrate=args.baudrate,
+                       protocol=args.protocol, window=args.window,
+                       incremental=args.incremental, resume=args.resume, board_id=board_id,
+                       ledger=args.ledger, timeout=args.timeout, low_latency=args.low_latency,
+                       auto_link=args.auto_link, relink=args.relink, link_cache=args.link_cache,
+                       link_peer=args.link_peer, probe_loopback=args.probe_loopback,
+                       report=report, record=record, replay=replay,
+                       replay_speed=args.replay_speed, log=log)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--port",
                         required=True, type=str,
-                        help="Serial device port: COMn for windows; /dev/ttyUSBn,/dev/ttySn for unix; /dev/tty.usbserial-abcde for MacOS")
+                        help="Serial device port: COMn for windows; /dev/ttyUSBn,/dev/ttySn for unix; /dev/tty.usbserial-abcde for MacOS. "
+                             "A comma separated list or glob pattern (/dev/ttyACM*) flashes all matching boards in parallel")
     parser.add_argument("--file",
                         #required=True, 
                         type=str,
@@ -255,21 +62,92 @@ if __name__ == '__main__':
     parser.add_argument("--protocol", 
                         default=DEF_PROTOCOL, type=str,
                         choices=PROTOCOL, 
-                        help="File transfer protocol. Default is " + DEF_PROTOCOL)
+                        help="File transfer protocol; adaptive switches between 1K and 128 byte blocks by the error rate. Default is " + DEF_PROTOCOL)
+    parser.add_argument("--low-latency", action='store_true',
+                        help="Ask the serial driver for low latency mode (no receive batching) where supported")
+    parser.add_argument("--window",
+                        default=DEF_WINDOW, type=lambda x: int(x,0),
+                        help="Outstanding blocks when the receiver asks for streaming ('G'), 0 disables streaming. Default is " + str(DEF_WINDOW))
     parser.add_argument("--model", type=str, action='append', help='--model="bin_file flash_address_hex offset_hex"')
+    parser.add_argument("--incremental", action='store_true',
+                        help="Only send the images whose content changed since the last upload to this device")
+    parser.add_argument("--resume", action='store_true',
+                        help="Continue an interrupted upload: skip the images already sent and resend only the unacknowledged part of the interrupted model")
+    parser.add_argument("--board-id", type=str,
+                        help="Device key in the deployment ledger. Default is the --port name")
+    parser.add_argument("--ledger",
+                        default=DEF_LEDGER, type=str,
+                        help="Deployment ledger file. Default is " + DEF_LEDGER)
+    parser.add_argument("--auto-link", action='store_true',
+                        help="Report the fastest stable baud rate and xmodem/xmodem1k probed on --port (cached per port and peer). "
+                             "Diagnostic only, --baudrate and --protocol are used as given")
+    parser.add_argument("--relink", action='store_true',
+                        help="With --probe-loopback, probe again instead of using the cached result")
+    parser.add_argument("--probe-loopback", action='store_true',
+                        help="With --auto-link, probe --port by writing random data at every candidate baud rate. "
+                             "Only for a loopback plug or echo firmware, never a board in its bootloader")
+    parser.add_argument("--link-peer", type=str,
+                        help="With --auto-link, report (or with --probe-loopback, cache) the link probed on --port with this peer. "
+                             "Default is " + DEF_PROBE_PEER + " when probing, else no cached link is used")
+    parser.add_argument("--link-cache",
+                        default=DEF_LINK_CACHE, type=str,
+                        help="Link probe cache file. Default is " + DEF_LINK_CACHE)
     parser.add_argument("--timeout",
                         default=DEF_TIMEOUT, type=lambda x: int(x,0),
                         help="Serial device timeout. Default is " + str(DEF_TIMEOUT))
+    parser.add_argument("--jobs",
+                        default=DEF_JOBS, type=lambda x: int(x,0),
+                        help="Boards flashed at the same time when --port matches several ports. Default is " + str(DEF_JOBS))
+    parser.add_argument("--fleet-timeout", type=lambda x: int(x,0),
+                        help="Give up on a board after this many seconds when flashing several ports")
+    parser.add_argument("--log-dir", type=str,
+                        help="Save the full output of every board in this directory when flashing several ports")
+    parser.add_argument("--report", type=str,
+                        help="Write per-block transfer telemetry to this file (JSON, or JSONL for a .jsonl name). "
+                             "When flashing several ports every port writes its own file, report.json becomes report.dev_ttyACM0.json")
+    parser.add_argument("--record", type=str,
+                        help="Log every byte read and written with timestamps to this trace file (gzip compressed for a .gz name). "
+                             "When flashing several ports every port writes its own file, named as for --report")
+    parser.add_argument("--replay", type=str,
+                        help="Run against a trace written by --record instead of the serial port. "
+                             "When flashing several ports every port reads its own file, named as for --report")
+    parser.add_argument("--replay-speed",
+                        default=DEF_SPEED, type=float,
+                        help="Replay timing: 1 as recorded, 2 twice as fast, 0 as fast as possible. Default is " + str(DEF_SPEED))
+    parser.add_argument("--exit", action='store_true',
+                        help="Exit after the transfer instead of showing the device messages")
 
     args = parser.parse_args()
 
-    dev_init()
+    if is_fleet(args.port):
+        ports = expand_ports(args.port)
+        if (len(ports) == 0):
+            print("--port matches no serial port")
+            sys.exit(-1)
+        ret = run_fleet(make_session, ports, jobs=args.jobs,
+                        timeout=args.fleet_timeout, log_dir=args.log_dir)
+        sys.exit(0 if ret else 1)
+
+    session = make_session(args.port, board_id=args.board_id)
+
+    try:
+        session.open()
+    except (serial.SerialException, OSError, ValueError):
+        print("Uart port open fail")
+        sys.exit(-1)
     print('Device init successfully')
 
-    ret = xmodem_send_bin()
+    ret = session.transfer()
     print("xmodem_send bin file result = ",ret)
+    print("xmodem_send bytes = ",session.total_bytes)
+
+    session.write_report()
+
+    if (args.exit):
+        session.close()
+        sys.exit(0 if ret else 1)
 
     # show message after send 
     while(True):
-        response = ser.readline().strip()
+        response = session.ser.readline().strip()
         print(str(response))
@@ -0,0 +1,463 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import serial
+import threading
+from xmodem_ext import XMODEMExt, BlockSizeController, DEF_WINDOW
+from xmodem_prompt import BootloaderSync
+from xmodem_buffer import BufferedReader
+from xmodem_ledger import DeployLedger, DEF_LEDGER, model_key
+from xmodem_link import auto_link, DEF_LINK_CACHE
+from xmodem_telemetry import TransferTelemetry
+from xmodem_sink import ReceiveSink
+from xmodem_trace import RecordingSerial, ReplaySerial, DEF_SPEED
+from xmodem_image import parse_model_arg, packet_count, make_preamble, open_image
+
+DEF_TIMEOUT = 60
+DEF_BAUDRATE = 115200
+DEF_PROTOCOL = 'xmodem'
+DEF_CHECK = 'crc16'
+
+ADAPTIVE_PROTOCOL = 'adaptive'
+
+PROTOCOL = [DEF_PROTOCOL, 'xmodem1k', ADAPTIVE_PROTOCOL]
+CHECK = [DEF_CHECK, 'sum8']
+
+def uart_open(ser, com, baudrate, timeout):
+    ser.port = com
+    ser.timeout = timeout
+    ser.baudrate = baudrate
+    ser.bytesize = serial.EIGHTBITS
+    ser.stopbits = serial.STOPBITS_ONE
+    ser.xonxoff = 0
+    ser.rtscts = 0
+    ser.parity = serial.PARITY_NONE
+    ser.open()
+
+class LogBuffer(object):
+    '''print() compatible log target collecting one session's output.'''
+
+    def __init__(self):
+        self.buf = io.StringIO()
+        self.lock = threading.Lock()
+
+    def __call__(self, *args, sep=' ', end='\n', **kwargs):
+        with self.lock:
+            self.buf.write(sep.join(str(arg) for arg in args) + end)
+
+    def getvalue(self):
+        with self.lock:
+            return self.buf.getvalue()
+
+class XmodemSession(object):
+    '''
+    State shared by the send and receive sessions: the port, its options
+    and where messages go.
+
+    A session owns everything a transfer touches, so any number of them
+    can run in the threads of one process.  ``log`` is a print() compatible
+    callable for all messages; ``on_progress(session, done, total, errors)``,
+    if given, replaces the progress bar.  ``abort()`` may be called from
+    another thread and makes the running transfer fail quickly.
+
+    ``record`` logs the port traffic to a trace file; ``replay`` runs the
+    session against such a trace instead of a port (see xmodem_trace).
+    '''
+
+    role = None
+
+    def __init__(self, port, baudrate=DEF_BAUDRATE, timeout=DEF_TIMEOUT, low_latency=False,
+                 auto_link=False, relink=False, link_cache=DEF_LINK_CACHE,
+                 link_peer=None, probe_loopback=False,
+                 report=None, record=None, replay=None, replay_speed=DEF_SPEED,
+                 log=print, on_progress=None, show_progress=True):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.low_latency = low_latency
+        self.auto_link = auto_link
+        self.relink = relink
+        self.link_cache = link_cache
+        self.link_peer = link_peer
+        self.probe_loopback = probe_loopback
+        self.report = report
+        self.record = record
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.log = log
+        self.on_progress = on_progress
+        self.show_progress = show_progress
+        self.ser = None
+        self.reader = None
+        self.telemetry = None
+        self.aborted = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if (self.auto_link and self.replay == None):
+            link = auto_link(self.port, peer=self.link_peer, probe=self.probe_loopback,
+                             cache_path=self.link_cache, refresh=self.relink, log=self.log)
+            # only a report: the bootloader UART runs at a fixed rate, the
+            # probe cannot tell the board to switch
+            if (link != None) and (link[0] != self.baudrate):
+                self.log("auto-link: keeping --baudrate {0}, the link probed at {1} baud needs the peer at that rate too".format(
+                    self.baudrate, link[0]))
+
+        if (self.replay != None):
+            ser = ReplaySerial(self.replay, speed=self.replay_speed)
+        else:
+            ser = serial.Serial()
+        uart_open(ser=ser, com=self.port, baudrate=self.baudrate, timeout=self.timeout)
+        if (self.record != None):
+            ser = RecordingSerial(ser, self.record)
+        self.ser = ser
+        self.ser.flushInput()
+        self.ser.flushOutput()
+        self.log("Open Serial Port", self.ser.port)
+        self.reader = BufferedReader(self.ser, low_latency=self.low_latency, log=self.log)
+
+        if (self.report != None):
+            self.telemetry = TransferTelemetry(self.role)
+
+    def write_report(self):
+        if (self.telemetry != None):
+            self.telemetry.write(self.report, log=self.log)
+            self.telemetry = None
+
+    def close(self):
+        self.write_report()
+        if (self.ser != None):
+            self.ser.close()
+            if (self.record != None) or (self.replay != None):
+                self.log(self.ser.report())
+            self.ser = None
+
+    def abort(self):
+        '''Stop the transfer from another thread by closing the port.'''
+        self.aborted = True
+        if (self.ser != None):
+            self.ser.close()
+
+    def getc(self, size, timeout=1):
+        return self.reader.read(size, timeout)
+
+    def putc(self, data, timeout=1):
+        return self.ser.write(data)
+
+    def make_modem(self, mode='xmodem', window=0, flush=None, controller=None):
+        getc, putc = self.getc, self.putc
+        if (self.telemetry != None):
+            getc, putc = self.telemetry.getc(getc), self.telemetry.putc(putc)
+        return XMODEMExt(getc=getc, putc=putc, mode=mode, window=window, flush=flush, controller=controller)
+
+    def progress(self, done, total, errors):
+        if callable(self.on_progress):
+            self.on_progress(self, done, total, errors)
+            return
+        if (not self.show_progress) or (total == 0):
+            return
+
+        bar_total = 30
+        bar_string_fmt = "\r[{}{}] {:.2%} {}/{} error: {}"
+        bar_cnt = (int((done/total)*bar_total))
+        space_cnt = bar_total - bar_cnt
+
+        progress = bar_string_fmt.format(
+            "█" * bar_cnt,
+            " " * space_cnt,
+            done/total,
+            done,
+            total,
+            errors
+        )
+
+        self.log(progress, end="")
+        percent = done/total
+
+        if percent >= 1:
+            self.log("\n")
+
+    def run(self):
+        '''open(), transfer(), close(); returns the transfer result.'''
+        try:
+            self.open()
+            return self.transfer()
+        except (serial.SerialException, OSError, ValueError, TypeError) as e:
+            # a port closed by abort() fails in whatever call was running
+            self.log("xmodem_{0} {1}: {2}".format(self.role, "aborted" if self.aborted else "FAIL!!!!", e))
+            return False
+        finally:
+            self.close()
+
+class SendSession(XmodemSession):
+    '''
+    Upload of a firmware image and/or models through the bootloader, the
+    library form of xmodem_send.py.  ``model_list`` holds "bin_file
+    flash_address_hex offset_hex" strings like the --model option.
+    '''
+
+    role = 'send'
+
+    def __init__(self, port, image_file=None, model_list=None, protocol=DEF_PROTOCOL, window=DEF_WINDOW,
+                 incremental=False, resume=False, board_id=None, ledger=DEF_LEDGER, **kwargs):
+        super().__init__(port, **kwargs)
+        self.image_file = image_file
+        self.model_list = model_list
+        self.protocol = protocol
+        self.window = window
+        self.incremental = incremental
+        self.resume = resume
+        self.board_id = board_id
+        self.ledger_path = ledger
+        self.sync = None
+        self.modem = None
+        self.total_packets = 0
+        self.total_bytes = 0
+        self.stream_bytes = 0
+
+    def getc(self, size, timeout=1):
+        # the receiver's start character is left in the prompt matcher
+        if (self.sync != None):
+            return self.sync.read(size, timeout)
+        return super().getc(size, timeout)
+
+    def _callback(self, total_packets, success_count, error_count):
+        self.progress(total_packets, self.total_packets, error_count)
+
+    def _on_resize(self, old_size, new_size):
+        # packets already acknowledged plus the rest at the new block size
+        self.total_packets = self.modem.success_count + packet_count(self.stream_bytes - self.modem.acked_bytes, new_size)
+        self.log("\nblock size {0} -> {1}".format(old_size, new_size))
+
+    def transfer(self):
+        model_list = self.model_list
+        image_file = self.image_file
+
+        if ((image_file == None) and (model_list == None)):
+            self.log("--file and --model error parameter")
+            return False
+
+        ledger = DeployLedger(self.ledger_path, self.board_id or self.port)
+
+        if (self.incremental or self.resume):
+            try:
+                image_file, model_list = ledger.changed(image_file, model_list, log=self.log)
+            except OSError as e:
+                self.log("incremental check fail:", e)
+                return False
+
+            if ((image_file == None) and (model_list == None)):
+                self.log("all images unchanged, nothing to send")
+                return True
+
+        self.sync = BootloaderSync(self.ser, reader=self.reader, log=self.log)
+        self.log("Please press reset button!!")
+
+        if (not self.sync.enter_xmodem()):
+            return False
+
+        ret = False
+        _wait_reboot_system = False
+        packtet_size = 1024
+
+        if (self.protocol == DEF_PROTOCOL):
+            packtet_size = 128
+
+        # adaptive starts with 1K blocks and mixes in 128 byte ones on a noisy line
+        mode = self.protocol
+        controller = None
+        if (self.protocol == ADAPTIVE_PROTOCOL):
+            mode = 'xmodem1k'
+            controller = BlockSizeController(byte_time=10.0 / self.baudrate, on_resize=self._on_resize)
+
+        self.modem = self.make_modem(mode=mode, window=self.window, flush=self.sync.flush, controller=controller)
+
+        if (image_file != None):
+            try:
+                stream = open_image(image_file)
+            except OSError as e:
+                self.log("open {0} fail: {1}".format(image_file, e))
+                return False
+
+            ret = self.send_stream(image_file, stream, len(stream), packtet_size)
+            stream.close()
+
+            if (ret) :
+                ledger.record_file(image_file)
+                _wait_reboot_system = True
+            else :
+                return ret
+
+        if model_list == None:
+            self.sync.report()
+            return ret
+
+        idx = 0
+
+        while (idx < len(model_list)):
+            model_arg = parse_model_arg(model_list[idx])
+
+            if (model_arg == None) :
+                self.log("--model error parameter")
+                return False
+
+            if (_wait_reboot_system and not self.wait_next_session()):
+                return False
+
+            model_file, model_position, model_offset = model_arg
+            key = model_key(model_position, model_offset)
+            resume_bytes = 0
+            if (self.resume):
+                resume_bytes = ledger.resume_point(key, model_file, packtet_size)
+                if (resume_bytes > 0):
+                    self.log("resume {0} from byte {1}".format(model_file, resume_bytes))
+
+            self.log("generate preamble data for {0}".format(model_file))
+            stream = make_preamble(model_position, model_offset + resume_bytes, packtet_size)
+            idx = idx + 1
+
+            ret = self.send_stream("preamble data", stream, len(stream.getvalue()), packtet_size, adaptive=False)
+            stream.close()
+
+            if (not ret) :
+                return ret
+
+            if (not self.wait_next_session()):
+                return False
+
+            try:
+                stream = open_image(model_file)
+            except OSError as e:
+                self.log("open {0} fail: {1}".format(model_file, e))
+                return False
+
+            resume_bytes = min(resume_bytes, len(stream))
+            stream.seek(resume_bytes)
+            ret = self.send_stream(model_file, stream, len(stream) - resume_bytes, packtet_size)
+            acked_bytes = min(resume_bytes + self.modem.acked_bytes, len(stream))
+            stream.close()
+
+            if (not ret) :
+                ledger.checkpoint(key, model_file, packtet_size, acked_bytes)
+                self.log("{0} bytes of {1} acknowledged, reset the board and rerun with --resume to continue".format(acked_bytes, model_file))
+                return ret
+            ledger.record_model(model_list[idx - 1])
+            _wait_reboot_system = True
+
+        self.sync.report()
+        return ret
+
+    def wait_next_session(self):
+        if (not self.sync.next_session(self.timeout)):
+            self.log("wait for next xmodem session FAIL!!!!")
+            return False
+        return True
+
+    def send_stream(self, name, stream, length, packtet_size, adaptive=True):
+        modem = self.modem
+        self.log("xmodem_sending >>", name)
+        if (adaptive and modem.controller != None):
+            packtet_size = modem.controller.size
+        self.total_packets = packet_count(length, packtet_size)
+        self.stream_bytes = length
+        if (self.telemetry != None):
+            self.telemetry.begin(name)
+        syscalls = self.reader.syscalls
+        ret = modem.send(stream, callback=self._callback, adaptive=adaptive)
+        if (self.telemetry != None):
+            self.telemetry.end(ret)
+        if (modem.total_packets > 0):
+            self.log("read syscalls per block: {0:.2f}".format((self.reader.syscalls - syscalls) / modem.total_packets))
+
+        if (ret) :
+            self.total_bytes += length
+            self.log("xmodem_send bin file done!!")
+        else :
+            self.log("xmodem_send bin file FAIL!!!!")
+        return ret
+
+class RecvSession(XmodemSession):
+    '''
+    Download of one file from a sending device, the library form of
+    xmodem_recv.py.  See ReceiveSink for ``path``, ``size`` and the
+    digest checks.
+    '''
+
+    role = 'recv'
+
+    def __init__(self, port, path, size=None, sha256=None, crc32=None, check=DEF_CHECK, **kwargs):
+        super().__init__(port, **kwargs)
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.crc32 = crc32
+        self.check = check
+        self.total_packets = 0
+        self.sink = None
+
+    def _callback(self, total_packets, success_count, error_count, packet_size):
+        self.total_packets = total_packets
+        if callable(self.on_progress):
+            self.on_progress(self, success_count, None, error_count)
+        elif self.show_progress:
+            self.log('packets {0} '.format(total_packets) + ' success {0}'.format(success_count) + ' error {0}'.format(error_count) + ' packet_size {0}'.format(packet_size))
+
+    def transfer(self):
+        modem = self.make_modem()
+        self.log("xmodem_receiving ... ", self.path)
+        stream = ReceiveSink(self.path, size=self.size)
+        self.sink = stream
+
+        _crc_mode = 1
+
+        if (self.check != DEF_CHECK) :
+            _crc_mode = 0
+
+        if (self.telemetry != None):
+            self.telemetry.begin(self.path)
+        ret = modem.recv(stream, crc_mode=_crc_mode, callback=self._callback)
+        if (self.telemetry != None):
+            self.telemetry.end(ret)
+        stream.close()
+        self.log(self.reader.report(self.total_packets))
+
+        if (ret) :
+            self.log("xmodem_recv bin file done!!")
+        else :
+            self.log("xmodem_recv bin file FAIL!!!!")
+            return ret
+
+        self.log(stream.report())
+        errors = stream.verify(sha256=self.sha256, crc32=self.crc32)
+        for error in errors:
+            self.log("xmodem_recv verify FAIL!!!!", error)
+        if (len(errors) > 0):
+            return False
+
+        return ret
@@ -0,0 +1,168 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import mmap
+import stat
+import time
+import zlib
+import hashlib
+
+PAD = b'\x1a'
+
+class ReceiveSink(object):
+    '''
+    Write-only stream handed to ``XMODEM.recv``.
+
+    Blocks are hashed (SHA-256 and CRC32) as they arrive, so the digests
+    are ready the moment the transfer ends.  The output is chosen from the
+    path:
+
+    * ``-`` writes to stdout, a FIFO or character device is written
+      through block by block, so a reader sees the data while it arrives;
+    * a regular file with a known ``size`` is preallocated to that size
+      and filled through a shared mmap;
+    * any other regular file is written through a buffered file object.
+
+    With ``size`` given, everything past ``size`` bytes is the xmodem
+    padding of the last block and is dropped (and not hashed).
+
+    :param path: Output path, or ``-`` for stdout.
+    :param size: Expected size in bytes, or None if unknown.
+    :param pad: Padding byte(s) the sender fills the last block with.
+    '''
+
+    def __init__(self, path, size=None, pad=PAD):
+        self.path = path
+        self.size = size
+        self.pad = pad[0]
+        self.received = 0
+        self.stripped = 0
+        self.overrun = 0
+        self.sha256 = hashlib.sha256()
+        self.crc = 0
+        self.first = None
+        self.last = None
+        self._map = None
+        self._file = None
+        self._through = False
+
+        if (path == '-'):
+            self._file = sys.__stdout__.buffer
+            self._through = True
+            self.mode = 'stdout'
+        elif os.path.exists(path) and not stat.S_ISREG(os.stat(path).st_mode):
+            self._file = open(path, 'wb', buffering=0)
+            self._through = True
+            self.mode = 'pipe'
+        elif (size != None) and (size > 0):
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self.mode = 'mmap'
+        else:
+            self._file = open(path, 'wb')
+            self.mode = 'file'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        now = time.monotonic()
+        if (self.first == None):
+            self.first = now
+        self.last = now
+
+        length = len(data)
+        keep = length
+        if (self.size != None):
+            keep = max(0, min(keep, self.size - self.received))
+            extra = memoryview(data)[keep:]
+            self.stripped += len(extra)
+            # padding is pad bytes only; anything else means the size was wrong
+            self.overrun += len(extra) - bytes(extra).count(self.pad)
+            data = memoryview(data)[:keep]
+
+        if (keep > 0):
+            self.sha256.update(data)
+            self.crc = zlib.crc32(data, self.crc)
+            if (self._map != None):
+                self._map[self.received:self.received + keep] = data
+            else:
+                self._file.write(data)
+                if self._through:
+                    self._file.flush()
+            self.received += keep
+        return length
+
+    def flush(self):
+        if (self._map != None):
+            self._map.flush()
+        elif (self._file != None):
+            self._file.flush()
+
+    def close(self):
+        if (self._map != None):
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            # a short transfer must not leave the preallocated tail behind
+            if (self.received < self.size):
+                self._file.truncate(self.received)
+        if (self._file != None):
+            if (self.mode == 'stdout'):
+                self._file.flush()
+            else:
+                self._file.close()
+            self._file = None
+
+    def throughput(self):
+        '''Sustained bytes/s from the first to the last block.'''
+        if (self.first == None) or (self.last <= self.first):
+            return 0.0
+        return self.received / (self.last - self.first)
+
+    def verify(self, sha256=None, crc32=None):
+        '''
+        Check the received data against the expected size and digests.
+        Returns a list of mismatch messages, empty when everything matches.
+        '''
+        errors = []
+        if (self.size != None) and (self.received != self.size):
+            errors.append("size {0} != expected {1}".format(self.received, self.size))
+        if (self.overrun > 0):
+            errors.append("{0} non-padding bytes past the expected size".format(self.overrun))
+        if (sha256 != None) and (self.sha256.hexdigest() != sha256.lower()):
+            errors.append("sha256 {0} != expected {1}".format(self.sha256.hexdigest(), sha256.lower()))
+        if (crc32 != None) and (self.crc != crc32):
+            errors.append("crc32 0x{0:08X} != expected 0x{1:08X}".format(self.crc, crc32))
+        return errors
+
+    def report(self):
+        return ("received {0} bytes ({1} padding stripped) to {2} [{3}], {4:.1f} bytes/s\n"
+                "sha256 = {5}\n"
+                "crc32 = 0x{6:08X}").format(self.received, self.stripped, self.path, self.mode,
+                                            self.throughput(), self.sha256.hexdigest(), self.crc)
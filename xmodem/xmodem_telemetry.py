@@ -0,0 +1,226 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import time
+import collections
+from xmodem import SOH, STX, ACK, NAK, CAN
+
+# A reply slower than this (seconds) is counted as a stall
+DEF_STALL = 1.0
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+HISTOGRAM_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+BLOCK_SIZE = {SOH[0]: 128, STX[0]: 1024}
+
+def percentile(values, pct):
+    '''Nearest-rank percentile of a sorted list.'''
+    if (len(values) == 0):
+        return None
+    rank = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+def bucket_label(bound):
+    return '<{0}ms'.format(bound) if bound else '>={0}ms'.format(HISTOGRAM_MS[-1])
+
+class SessionStats(object):
+    '''Counters and per-block records of one xmodem session.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.monotonic()
+        self.end = None
+        self.ok = None
+        self.blocks = []
+        self.payload_bytes = 0
+        self.wire_tx = 0
+        self.wire_rx = 0
+        self.retransmits = 0
+        self.naks = 0
+        self.cans = 0
+        self.stalls = 0
+
+    def block(self, seq, size, latency, retries):
+        self.blocks.append({'seq': seq, 'size': size, 'latency': latency, 'retries': retries})
+        self.payload_bytes += size
+        if (latency >= DEF_STALL):
+            self.stalls += 1
+
+    def summary(self):
+        duration = (self.end or time.monotonic()) - self.start
+        latencies = sorted(block['latency'] for block in self.blocks)
+        wire_bytes = self.wire_tx + self.wire_rx
+
+        histogram = collections.OrderedDict((bucket_label(bound), 0) for bound in HISTOGRAM_MS + [None])
+        for latency in latencies:
+            bound = next((bound for bound in HISTOGRAM_MS if latency * 1000 < bound), None)
+            histogram[bucket_label(bound)] += 1
+
+        def ms(value):
+            return None if (value == None) else round(value * 1000, 3)
+
+        return {
+            'session': self.name,
+            'ok': self.ok,
+            'duration_s': round(duration, 6),
+            'blocks': len(self.blocks),
+            'payload_bytes': self.payload_bytes,
+            'wire_bytes': wire_bytes,
+            'throughput_Bps': round(self.payload_bytes / duration, 1) if duration > 0 else None,
+            'efficiency': round(self.payload_bytes / wire_bytes, 4) if wire_bytes else None,
+            'retransmits': self.retransmits,
+            'naks': self.naks,
+            'cans': self.cans,
+            'stalls': self.stalls,
+            'latency_ms': {
+                'p50': ms(percentile(latencies, 50)),
+                'p95': ms(percentile(latencies, 95)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1] if latencies else None),
+            },
+            'latency_histogram': histogram,
+        }
+
+class TransferTelemetry(object):
+    '''
+    Per-block transfer instrumentation, fed by tapping getc/putc.
+
+    The tap classifies the bytes going through the wire, so it works for
+    any sender or receiver built on those two callables.  As a sender
+    ('send') it times each block from its (re)transmission to its ACK; as
+    a receiver ('recv') it times each block from its header byte to the
+    ACK we return.  NAK and CAN in either direction, retransmissions and
+    replies slower than DEF_STALL are counted per session.
+    '''
+
+    def __init__(self, role):
+        self.role = role
+        self.sessions = []
+        self.current = None
+        self._pending = collections.deque()
+        self._block = None
+
+    def begin(self, name):
+        self.current = SessionStats(name)
+        self.sessions.append(self.current)
+        self._pending.clear()
+        self._block = None
+
+    def end(self, ok):
+        if (self.current != None):
+            self.current.end = time.monotonic()
+            self.current.ok = bool(ok)
+            self.current = None
+
+    def getc(self, getc):
+        def tap(size, timeout=1):
+            data = getc(size, timeout)
+            if (self.current != None):
+                self._on_rx(data)
+            return data
+        return tap
+
+    def putc(self, putc):
+        def tap(data, timeout=1):
+            if (self.current != None):
+                self._on_tx(data)
+            return putc(data, timeout)
+        return tap
+
+    def _on_tx(self, data):
+        session = self.current
+        session.wire_tx += len(data)
+        now = time.monotonic()
+
+        if (self.role == 'send'):
+            if (len(data) > 3) and (data[0] in BLOCK_SIZE):
+                seq = data[1]
+                for pending in self._pending:
+                    if (pending[0] == seq):
+                        # same block again: a retransmission (maybe split smaller)
+                        pending[1] = now
+                        pending[2] = BLOCK_SIZE[data[0]]
+                        pending[3] += 1
+                        session.retransmits += 1
+                        return
+                self._pending.append([seq, now, BLOCK_SIZE[data[0]], 0])
+            return
+
+        if (data[:1] == ACK) and (self._block != None):
+            seq, start, size, retries = self._block
+            session.block(seq, size, now - start, retries)
+            self._block = None
+        elif (data[:1] == NAK):
+            session.naks += 1
+            if (self._block != None):
+                session.retransmits += 1
+                self._block = None
+        elif (data[:1] == CAN):
+            session.cans += 1
+
+    def _on_rx(self, data):
+        session = self.current
+        now = time.monotonic()
+
+        if not data:
+            # read timeout
+            session.stalls += 1
+            return
+        session.wire_rx += len(data)
+
+        if (self.role == 'send'):
+            if (data == ACK) and self._pending:
+                seq, start, size, retries = self._pending.popleft()
+                session.block(seq, size, now - start, retries)
+            elif (data == NAK):
+                session.naks += 1
+            elif (data == CAN):
+                session.cans += 1
+            return
+
+        if (len(data) == 1) and (self._block == None) and (data[0] in BLOCK_SIZE):
+            self._block = [None, now, BLOCK_SIZE[data[0]], 0]
+        elif (len(data) == 1) and (self._block != None) and (self._block[0] == None):
+            self._block[0] = data[0]
+        elif (data == CAN):
+            session.cans += 1
+
+    def report(self):
+        return [session.summary() for session in self.sessions]
+
+    def write(self, path, log=print):
+        '''
+        Write the report: one JSON document, or with a .jsonl path one line
+        per block followed by one summary line per session.
+        '''
+        with open(path, 'w') as f:
+            if path.endswith('.jsonl'):
+                for session in self.sessions:
+                    for block in session.blocks:
+                        record = dict(block, session=session.name)
+                        record['latency'] = round(record['latency'], 6)
+                        f.write(json.dumps(record) + '\n')
+                    f.write(json.dumps(dict(session.summary(), type='summary')) + '\n')
+            else:
+                json.dump({'role': self.role, 'sessions': self.report()}, f, indent=2)
+        log("transfer report >>", path)
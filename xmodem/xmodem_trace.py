@@ -0,0 +1,421 @@
+# MIT License
+#
+# Copyright (c) 2023 Himax Technologies, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import gzip
+import json
+import time
+import struct
+import argparse
+import threading
+import serial
+
+TRACE_MAGIC = b'SERTRACE'
+TRACE_VERSION = 1
+
+# record: kind, microseconds since the previous record, data length
+RECORD = struct.Struct('<BIH')
+MAX_DELTA_US = 0xffffffff
+MAX_DATA = 0xffff
+
+RX = 0      # bytes the device sent
+TX = 1      # bytes the host wrote
+MARK = 2    # no data, only carries time across gaps longer than MAX_DELTA_US
+
+KIND_NAME = {RX: 'rx', TX: 'tx', MARK: 'mark'}
+
+DEF_SPEED = 1.0
+
+# bytes of each record shown by --dump
+DUMP_BYTES = 48
+
+# with --replay-speed 0, how long a read waiting on the host gives other
+# threads to write before it times out
+FAST_WAIT = 0.005
+
+def open_trace(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+class TraceWriter(object):
+    '''
+    Timestamped log of the bytes read and written on a serial port.
+
+    The file is TRACE_MAGIC, a version byte, a length prefixed JSON header
+    and then one RECORD per read or write followed by its data, so a busy
+    session costs 7 bytes per call on top of its payload (gzip compressed
+    for a .gz name).  Times are microseconds since the previous record.
+    Thread safe.
+    '''
+
+    def __init__(self, path, header=None):
+        self.path = path
+        self.file = open_trace(path, 'wb')
+        head = json.dumps(dict(header or {}, start=time.time())).encode()
+        self.file.write(TRACE_MAGIC + bytes([TRACE_VERSION]) + struct.pack('<I', len(head)) + head)
+        self.lock = threading.Lock()
+        self.last = time.monotonic()
+        self.records = 0
+        self.bytes = {RX: 0, TX: 0}
+
+    def write(self, kind, data):
+        with self.lock:
+            if (self.file == None):
+                return
+            now = time.monotonic()
+            delta = int((now - self.last) * 1e6)
+            self.last = now
+            while (delta > MAX_DELTA_US):
+                self.file.write(RECORD.pack(MARK, MAX_DELTA_US, 0))
+                delta -= MAX_DELTA_US
+            pos = 0
+            while True:
+                part = data[pos:pos + MAX_DATA]
+                self.file.write(RECORD.pack(kind, delta, len(part)))
+                self.file.write(part)
+                self.records += 1
+                delta = 0
+                pos += MAX_DATA
+                if (pos >= len(data)):
+                    break
+            self.bytes[kind] += len(data)
+
+    def close(self):
+        with self.lock:
+            if (self.file != None):
+                self.file.close()
+                self.file = None
+
+    def report(self):
+        return "trace: {0} records, {1} bytes tx, {2} bytes rx >> {3}".format(
+            self.records, self.bytes[TX], self.bytes[RX], self.path)
+
+def read_trace(path):
+    '''Returns (header, records) with records as (kind, seconds since start, data).'''
+    with open_trace(path, 'rb') as f:
+        magic = f.read(len(TRACE_MAGIC) + 1)
+        if (magic[:-1] != TRACE_MAGIC):
+            raise ValueError("{0} is not a serial trace".format(path))
+        if (magic[-1] != TRACE_VERSION):
+            raise ValueError("{0}: unsupported trace version {1}".format(path, magic[-1]))
+        head_len, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(head_len).decode())
+        records = []
+        t = 0
+        while True:
+            head = f.read(RECORD.size)
+            if (len(head) < RECORD.size):
+                break
+            kind, delta, length = RECORD.unpack(head)
+            data = f.read(length)
+            t += delta / 1e6
+            if (kind != MARK):
+                records.append((kind, t, data))
+    return header, records
+
+class RecordingSerial(object):
+    '''
+    Wraps a pyserial port and logs everything read from and written to it
+    in a TraceWriter.  All other attributes go to the wrapped port, so it
+    can be used wherever the port was.
+    '''
+
+    _own = ('ser', 'trace')
+
+    def __init__(self, ser, path):
+        self.ser = ser
+        self.trace = TraceWriter(path, {'port': ser.port, 'baudrate': ser.baudrate})
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.ser, name, value)
+
+    def _rx(self, data):
+        if data:
+            self.trace.write(RX, data)
+        return data
+
+    def read(self, size=1):
+        return self._rx(self.ser.read(size))
+
+    def read_until(self, *args, **kwargs):
+        return self._rx(self.ser.read_until(*args, **kwargs))
+
+    def readline(self, *args, **kwargs):
+        return self._rx(self.ser.readline(*args, **kwargs))
+
+    def write(self, data):
+        ret = self.ser.write(data)
+        self.trace.write(TX, bytes(data))
+        return ret
+
+    def close(self):
+        self.ser.close()
+        self.trace.close()
+
+    def report(self):
+        return self.trace.report()
+
+class ReplaySerial(object):
+    '''
+    Stand-in for serial.Serial that plays back the device side of a trace.
+
+    Each recorded read is tied to the host write it followed: it becomes
+    readable once the host has written as many bytes as it had then, after
+    the same delay as in the recording divided by ``speed`` (1 keeps the
+    original timing, 0 replays as fast as possible, handing out the recorded
+    data only as reads ask for it).  So the host code runs for real against
+    the device's recorded answers and timing, and slowdowns on the host
+    side show in the wall time of the replay.  Once the recording is used
+    up, reads return at once with what is left.
+    ``divergence`` is the first tx offset where the host wrote something
+    else than in the recording, None while it matches.  If the host keeps
+    reading without writing what a read waits for, that read is played
+    after its recorded pause anyway (counted in ``forced``).
+    '''
+
+    def __init__(self, path, port=None, baudrate=9600, timeout=None, speed=DEF_SPEED, **kwargs):
+        self.path = path
+        self.header, records = read_trace(path)
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.speed = speed
+        self.is_open = False
+        self.cond = threading.Condition()
+
+        # rx records as (tx bytes before it, time of that last tx, time, data)
+        self.rx = []
+        self.tx_data = bytearray()
+        anchor = 0.0
+        for kind, t, data in records:
+            if (kind == TX):
+                self.tx_data += data
+                anchor = t
+            else:
+                self.rx.append((len(self.tx_data), anchor, t, data))
+
+        self.index = 0
+        self.buf = bytearray()
+        self.tx_bytes = 0
+        self.gate_times = {}
+        self.last_release = 0.0
+        self.divergence = None
+        self.blocked_since = None
+        self.forced = 0
+        self.start = None
+
+        if (port != None):
+            self.open()
+
+    @property
+    def name(self):
+        return self.port
+
+    def open(self):
+        with self.cond:
+            self.is_open = True
+            self.start = time.monotonic()
+            self.gate_times = {0: self.start}
+            self.last_release = self.start
+
+    def close(self):
+        with self.cond:
+            self.is_open = False
+            self.cond.notify_all()
+
+    def _check_open(self):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+
+    def _release_time(self, index):
+        '''When rx record index becomes readable, None while it waits for a host write.'''
+        gate, anchor, t, data = self.rx[index]
+        gate_time = self.gate_times.get(gate)
+        if (gate_time == None):
+            return None
+        if (self.speed == 0):
+            return max(gate_time, self.last_release)
+        return max(gate_time + (t - anchor) / self.speed, self.last_release)
+
+    def _gap(self, index):
+        gate, anchor, t, data = self.rx[index]
+        if (self.speed == 0):
+            return FAST_WAIT
+        previous = self.rx[index - 1][2] if (index > 0) else 0.0
+        return (t - max(anchor, previous)) / self.speed
+
+    def _force(self, index, now):
+        # carry on as if the host had written up to where the recording was
+        gate, anchor, t, data = self.rx[index]
+        self.gate_times[gate] = now if (self.speed == 0) else now - (t - anchor) / self.speed
+        self.tx_bytes = max(self.tx_bytes, gate)
+        self.blocked_since = None
+        self.forced += 1
+
+    def _release(self, ready=None):
+        # as fast as possible only plays what a read needs, so console text
+        # does not pile up in front of a flush that came before it in the
+        # recording
+        now = time.monotonic()
+        while (self.index < len(self.rx)):
+            if (self.speed == 0) and ((ready == None) or ready()):
+                break
+            release = self._release_time(self.index)
+            if (release == None) or (release > now):
+                break
+            self.buf += self.rx[self.index][3]
+            self.last_release = release
+            self.index += 1
+
+    def _wait(self, ready, timeout):
+        '''Wait under self.cond until ready() or timeout.'''
+        deadline = None if (timeout == None) else time.monotonic() + timeout
+        # only a read that starts while the host is already stuck may move
+        # the device on, a single read just times out as it would have
+        stuck = (self.blocked_since != None)
+        while True:
+            self._check_open()
+            self._release(ready)
+            if ready() or (self.index >= len(self.rx)):
+                return
+            now = time.monotonic()
+            if (deadline != None) and (now >= deadline):
+                return
+            wait = None if (deadline == None) else deadline - now
+            release = self._release_time(self.index)
+            if (release == None):
+                # The host reads instead of writing what the device waited
+                # for (its output depends on how the reads were split, say):
+                # after the recorded pause the device goes on anyway.
+                if (self.blocked_since == None):
+                    self.blocked_since = now
+                if stuck or (deadline == None):
+                    release = self.blocked_since + self._gap(self.index)
+                    if (release <= now):
+                        self._force(self.index, now)
+                        continue
+                elif (self.speed == 0):
+                    tx_bytes = self.tx_bytes
+                    self.cond.wait(FAST_WAIT if (wait == None) else min(wait, FAST_WAIT))
+                    if (self.tx_bytes == tx_bytes):
+                        return
+                    continue
+            if (release != None):
+                wait = release - now if (wait == None) else min(wait, release - now)
+            self.cond.wait(wait)
+
+    def _take(self, size):
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+    def read(self, size=1):
+        with self.cond:
+            self._wait(lambda: len(self.buf) >= size, self.timeout)
+            return self._take(size)
+
+    def read_until(self, expected=serial.LF, size=None):
+        with self.cond:
+            def ready():
+                return (expected in self.buf) or ((size != None) and (len(self.buf) >= size))
+            self._wait(ready, self.timeout)
+            end = self.buf.find(expected)
+            end = len(self.buf) if (end < 0) else end + len(expected)
+            if (size != None):
+                end = min(end, size)
+            return self._take(end)
+
+    def readline(self, size=None):
+        return self.read_until(serial.LF, size)
+
+    def write(self, data):
+        data = bytes(data)
+        with self.cond:
+            self._check_open()
+            if (self.divergence == None) and (self.tx_data[self.tx_bytes:self.tx_bytes + len(data)] != data):
+                self.divergence = self.tx_bytes
+            self.tx_bytes += len(data)
+            self.blocked_since = None
+            now = time.monotonic()
+            index = self.index
+            while (index < len(self.rx)) and (self.rx[index][0] <= self.tx_bytes):
+                self.gate_times.setdefault(self.rx[index][0], now)
+                index += 1
+            self.cond.notify_all()
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        with self.cond:
+            self._check_open()
+            self._release()
+            return len(self.buf)
+
+    def reset_input_buffer(self):
+        # drops only what was played already: every recorded read was
+        # something the host got after its flushes
+        with self.cond:
+            self.buf.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    flushInput = reset_input_buffer
+    flushOutput = reset_output_buffer
+
+    def report(self):
+        elapsed = time.monotonic() - self.start if (self.start != None) else 0.0
+        match = "matches the recording" if (self.divergence == None) else "differs from the recording at byte {0}".format(self.divergence)
+        return "replay: {0}/{1} reads played in {2:.3f}s ({3} without their host output), host output {4} ({5} of {6} bytes written)".format(
+            self.index, len(self.rx), elapsed, self.forced, match, self.tx_bytes, len(self.tx_data))
+
+def summary(path):
+    header, records = read_trace(path)
+    duration = records[-1][1] if records else 0.0
+    lines = ["{0}: port {1}, baudrate {2}, {3} records in {4:.3f}s".format(
+        path, header.get('port'), header.get('baudrate'), len(records), duration)]
+    for kind in (TX, RX):
+        sizes = [len(data) for k, t, data in records if (k == kind)]
+        lines.append("  {0}: {1} calls, {2} bytes".format(KIND_NAME[kind], len(sizes), sum(sizes)))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show a serial trace written with --record")
+    parser.add_argument("trace", type=str, help="Trace file")
+    parser.add_argument("--dump", action='store_true',
+                        help="Print every record with its time")
+    args = parser.parse_args()
+
+    print(summary(args.trace))
+    if (args.dump):
+        header, records = read_trace(args.trace)
+        for kind, t, data in records:
+            print("{0:12.6f} {1} {2:5d} {3}".format(t, KIND_NAME[kind], len(data), data[:DUMP_BYTES]))